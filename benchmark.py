@@ -0,0 +1,219 @@
+import sys
+import os
+import io
+import ssl
+import json
+import time
+import getopt
+import socket
+import logging
+import builtins
+import tempfile
+import contextlib
+import subprocess
+import tracemalloc
+import http.client
+from qumulo.rest_client import RestClient
+import quotas
+import users
+import nfs_exports
+import smb_shares
+import others
+from common import instrument, DUMP_FORMATS, NODE_BALANCING
+
+# Runs every script's dump and set against mock_cluster.py and reports wall
+# time, API calls and peak Python memory for each phase:
+#   dump    - *_list against the full synthetic dataset
+#   set     - *_define against the same directories with no objects yet
+#   resync  - *_define again, when everything already matches
+
+def main(argv):
+    logging.basicConfig(level=logging.ERROR, format='%(asctime)s,%(levelname)s,%(message)s')
+
+    err_msg = '''
+usage: benchmark.py [--latency-ms N] [--error-rate P] [--node-balancing POLICY] [--format FORMAT] [--workers N] [--modules LIST] [--output FILE] [--quotas N] [--shares N] [--exports N] [--users N] [--policies N] [--tenants N]
+
+Measure the dump and set scripts against a local mock cluster.
+
+optional arguments:
+-h, --help          Show this help message and exit
+--latency-ms N      Delay the mock cluster adds to every request (default: 0).
+--error-rate P      Share of requests the mock cluster fails with 503 (default: 0).
+--node-balancing POLICY  Spread the requests over all mock cluster nodes, round-robin or least-outstanding (default: all go to one node).
+--format FORMAT     Dump format used by the scripts that support it (default: json).
+--workers N         Worker count passed to the scripts that support it (default: 1).
+--modules LIST      Comma separated subset of quotas,users,nfs,smb,others (default: all).
+--output FILE       Also write the results as JSON into FILE.
+--quotas N ...      Dataset sizes, see mock_cluster.py --help.
+    '''
+    try:
+        opts, args = getopt.getopt(argv, 'h', ["help", "latency-ms=", "error-rate=", "node-balancing=", "format=", "workers=", "modules=", "output=",
+            "quotas=", "shares=", "exports=", "users=", "policies=", "tenants="])
+    except getopt.GetoptError:
+        print (err_msg)
+        sys.exit(2)
+
+    latency_ms = 0
+    error_rate = 0.0
+    node_balancing = None
+    dump_format = 'json'
+    workers = 1
+    modules = list(MODULES)
+    output = None
+    sizes = {}
+    try:
+        for opt, arg in opts:
+            if opt in ("-h", "--help"):
+                print (err_msg)
+                sys.exit()
+            elif opt == "--latency-ms":
+                latency_ms = int(arg)
+            elif opt == "--error-rate":
+                error_rate = float(arg)
+            elif opt == "--node-balancing":
+                if arg not in NODE_BALANCING:
+                    raise ValueError(arg)
+                node_balancing = arg
+            elif opt == "--format":
+                if arg not in DUMP_FORMATS:
+                    raise ValueError(arg)
+                dump_format = arg
+            elif opt == "--workers":
+                workers = max(1, int(arg))
+            elif opt == "--modules":
+                modules = arg.split(',')
+            elif opt == "--output":
+                output = arg
+            else:
+                sizes[opt[2:]] = int(arg)
+    except ValueError:
+        print (err_msg)
+        sys.exit(2)
+    for module in modules:
+        if module not in MODULES:
+            print (f'Unknown module: {module}')
+            sys.exit(2)
+
+    results = run_benchmark(modules, sizes, latency_ms, error_rate, dump_format, workers, node_balancing)
+    print_results(results)
+    if output is not None:
+        output_file = open(output, 'w')
+        json.dump(results, output_file, indent=4)
+        output_file.close()
+
+# module name -> (dump function, set function)
+MODULES = {
+    'quotas' : (lambda rc, dump_format, workers: quotas.quota_list(rc, dump_format),
+                lambda rc, dump_format, workers: quotas.quota_define(rc, True, dump_format, workers)),
+    'users' : (lambda rc, dump_format, workers: users.users_list(rc, dump_format),
+               lambda rc, dump_format, workers: users.users_define(rc, True, dump_format=dump_format)),
+    'nfs' : (lambda rc, dump_format, workers: nfs_exports.nfs_list(rc, dump_format=dump_format),
+             lambda rc, dump_format, workers: nfs_exports.nfs_define(rc, True, dump_format=dump_format)),
+    'smb' : (lambda rc, dump_format, workers: smb_shares.smb_list(rc, workers=workers, dump_format=dump_format),
+             lambda rc, dump_format, workers: smb_shares.smb_define(rc, True, dump_format=dump_format)),
+    'others' : (lambda rc, dump_format, workers: others.others_list(rc),
+                lambda rc, dump_format, workers: others.others_define(rc, True)),
+}
+
+class MockControl:
+    '''Starts mock_cluster.py in its own process and drives its control endpoints'''
+    def __init__(self, sizes, latency_ms, all_nodes=False):
+        self.port = free_port()
+        command = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), 'mock_cluster.py'),
+            '--port', str(self.port), '--latency-ms', str(latency_ms)]
+        if all_nodes:
+            command.append('--all-nodes')
+        for name, value in sizes.items():
+            command += [f'--{name}', str(value)]
+        self.process = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self.context = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
+        self.context.check_hostname = False
+        self.context.verify_mode = ssl.CERT_NONE
+        deadline = time.time() + 600
+        while True:
+            try:
+                self.call('GET', '/_mock/stats')
+                break
+            except OSError:
+                if self.process.poll() is not None or time.time() > deadline:
+                    raise RuntimeError('mock_cluster.py did not start')
+                time.sleep(0.2)
+
+    def call(self, method, path, body=None):
+        connection = http.client.HTTPSConnection('127.0.0.1', self.port, context=self.context, timeout=600)
+        payload = json.dumps(body) if body is not None else None
+        connection.request(method, path, body=payload, headers={'Content-Type': 'application/json'})
+        data = json.loads(connection.getresponse().read())
+        connection.close()
+        return data
+
+    def close(self):
+        self.process.terminate()
+        self.process.wait()
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+def measure(mock, func):
+    mock.call('POST', '/_mock/stats/reset')
+    tracemalloc.start()
+    start = time.perf_counter()
+    error = None
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            func()
+    except Exception as excpt:
+        error = f'{type(excpt).__name__}: {excpt}'
+    seconds = time.perf_counter() - start
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    stats = mock.call('GET', '/_mock/stats')
+    return {
+        "seconds" : round(seconds, 3),
+        "api_calls" : stats['requests'],
+        "peak_mib" : round(peak / 1024 ** 2, 2),
+        "endpoints" : stats['endpoints'],
+        "nodes" : stats['nodes'],
+        "error" : error
+    }
+
+def run_benchmark(modules, sizes, latency_ms, error_rate, dump_format, workers, node_balancing=None):
+    # The set phases are not interactive: every prompt in the scripts gets an
+    # empty answer and -a is passed wherever the scripts support it.
+    builtins.input = lambda prompt='': ''
+    others.getpass = lambda prompt='': ''
+
+    mock = MockControl(sizes, latency_ms, node_balancing is not None)
+    work_dir = tempfile.mkdtemp(prefix='qumulo_dump_bench_')
+    cwd = os.getcwd()
+    os.chdir(work_dir)
+    results = []
+    try:
+        for module in modules:
+            dump, define = MODULES[module]
+            mock.call('POST', '/_mock/reset', sizes)
+            # Errors are only injected after the login, which is not retried
+            mock.call('POST', '/_mock/faults', {'error_rate': 0})
+            rc = RestClient('127.0.0.1', mock.port)
+            rc.login('admin', 'Admin123')
+            rc = instrument(rc, node_balancing)
+            mock.call('POST', '/_mock/faults', {'error_rate': error_rate})
+            results.append(dict(measure(mock, lambda: dump(rc, dump_format, workers)), module=module, phase='dump'))
+            mock.call('POST', '/_mock/reset', dict(sizes, with_objects=False))
+            results.append(dict(measure(mock, lambda: define(rc, dump_format, workers)), module=module, phase='set'))
+            results.append(dict(measure(mock, lambda: define(rc, dump_format, workers)), module=module, phase='resync'))
+    finally:
+        os.chdir(cwd)
+        mock.close()
+    return results
+
+def print_results(results):
+    print(f'{"module":<8} {"phase":<7} {"seconds":>9} {"api calls":>10} {"peak MiB":>9}  error')
+    for result in results:
+        print(f'{result["module"]:<8} {result["phase"]:<7} {result["seconds"]:>9.3f} '
+            f'{result["api_calls"]:>10} {result["peak_mib"]:>9.2f}  {result["error"] or ""}')
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,1004 @@
+import io
+import os
+import sys
+import gzip
+import json
+import mmap
+import time
+import queue
+import atexit
+import re
+import random
+import fnmatch
+import textwrap
+import logging
+import sqlite3
+import threading
+import http.client
+import collections.abc
+import qumulo.lib.request
+import qumulo.rest_client
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+class TenantMap:
+    '''Tenant id <-> name lookups for one cluster session.
+
+    The tenant list is loaded with a single list_tenants call on first use and
+    reloaded when an id or a name isn't found, in case the tenant was created
+    after the list was loaded. Each missing key triggers at most one reload.
+    '''
+    def __init__(self, rc):
+        self.rc = rc
+        self.lock = threading.Lock()
+        self.names = None
+        self.ids = None
+        self.missed = set()
+
+    def refresh(self):
+        names = {}
+        ids = {}
+        for tenant in self.rc.multitenancy.list_tenants():
+            names[tenant.id] = tenant.name
+            ids[tenant.name] = tenant.id
+        self.names = names
+        self.ids = ids
+        logging.debug(f'{len(names)} tenants were loaded')
+
+    def lookup(self, table, key):
+        with self.lock:
+            if self.names is None:
+                self.refresh()
+            if key not in getattr(self, table) and (table, key) not in self.missed:
+                self.missed.add((table, key))
+                self.refresh()
+            return getattr(self, table).get(key)
+
+    def name(self, tenant_id):
+        return self.lookup('names', tenant_id)
+
+    def id(self, tenant_name):
+        return self.lookup('ids', tenant_name)
+
+def run_parallel(rc, func, items, workers):
+    '''Call func(rc, item) for every item, at most `workers` at a time.
+
+    A RestClient holds a single HTTPS connection, so every worker thread gets
+    its own clone of rc. Returns a (result, error) pair per item, in the order
+    of items. How many of the workers may send requests at the same time is
+    adapted to the cluster by a ConcurrencyLimiter.
+    '''
+    def call(client, item):
+        try:
+            return func(client, item), None
+        except Exception as excpt:
+            return None, excpt
+
+    if workers <= 1:
+        return [call(rc, item) for item in items]
+
+    local = threading.local()
+    limiter = ConcurrencyLimiter(workers)
+    def worker_call(item):
+        if not hasattr(local, 'rc'):
+            local.rc = rc.clone()
+            feedback.limiter = limiter
+        limiter.acquire()
+        try:
+            return call(local.rc, item)
+        finally:
+            limiter.release()
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(worker_call, items))
+
+class ConcurrencyLimiter:
+    '''Additive increase, multiplicative decrease limit on calls in flight.
+
+    Starts at `maximum`. Every call that had to be retried, or a moving
+    average latency more than `latency_factor` times the lowest one seen,
+    halves the limit; every other call raises it by 1/limit, up to maximum.
+    After a decrease the calls already in flight are not counted again.
+    '''
+    def __init__(self, maximum, latency_factor=3.0):
+        self.condition = threading.Condition()
+        self.maximum = maximum
+        self.latency_factor = latency_factor
+        self.limit = float(maximum)
+        self.active = 0
+        self.average = None
+        self.baseline = None
+        self.cooldown = 0
+
+    def acquire(self):
+        with self.condition:
+            while self.active >= int(self.limit):
+                self.condition.wait()
+            self.active += 1
+
+    def release(self):
+        with self.condition:
+            self.active -= 1
+            self.condition.notify()
+
+    def observe(self, seconds, congested):
+        with self.condition:
+            self.average = seconds if self.average is None else 0.9 * self.average + 0.1 * seconds
+            self.baseline = self.average if self.baseline is None else min(self.baseline, self.average)
+            slow = self.average > self.latency_factor * max(self.baseline, LATENCY_FLOOR_SECONDS)
+            if self.cooldown > 0:
+                self.cooldown -= 1
+            elif congested or slow:
+                self.limit = max(1.0, self.limit / 2)
+                self.cooldown = self.active + int(self.limit)
+                logging.debug(f'Concurrency was lowered to {int(self.limit)} ({"errors" if congested else "latency"})')
+            elif self.limit < self.maximum:
+                self.limit = min(float(self.maximum), self.limit + 1 / self.limit)
+                self.condition.notify_all()
+
+# Latencies below this are never treated as a sign of an overloaded cluster
+LATENCY_FLOOR_SECONDS = 0.01
+
+# Every API call made by a run_parallel worker reports to that run's limiter
+feedback = threading.local()
+
+def report_call(seconds, congested):
+    limiter = getattr(feedback, 'limiter', None)
+    if limiter is not None:
+        limiter.observe(seconds, congested)
+
+def stream(items, size=100):
+    '''Iterate over items while they are produced by a thread of their own.
+
+    Up to `size` items are buffered in a bounded queue, so the producer can
+    run ahead of the consumer, but not by more than that. An exception raised
+    by the producer is raised again in the consumer, and the producer stops
+    when the consumer does.
+    '''
+    buffer = queue.Queue(maxsize=size)
+    stopped = threading.Event()
+    done = object()
+    def produce():
+        try:
+            for item in items:
+                if stopped.is_set():
+                    return
+                buffer.put((item, None))
+            buffer.put((done, None))
+        except BaseException as excpt:
+            buffer.put((done, excpt))
+
+    threading.Thread(target=produce, daemon=True).start()
+    try:
+        while True:
+            item, excpt = buffer.get()
+            if item is done:
+                break
+            yield item
+        if excpt is not None:
+            raise excpt
+    finally:
+        # Unblock a producer that is waiting for room in the queue
+        stopped.set()
+        while not buffer.empty():
+            buffer.get_nowait()
+
+class PathCache:
+    '''Path -> file id pairs seen on a cluster, kept in a SQLite file between runs.
+
+    Entries are only hints: PathResolver checks them against the cluster
+    before using them.
+    '''
+    def __init__(self, rc, file_name='path_cache.sqlite'):
+        self.cluster = f'{rc.conninfo.host}:{rc.conninfo.port}'
+        self.db = sqlite3.connect(file_name)
+        self.db.execute('CREATE TABLE IF NOT EXISTS paths (cluster TEXT NOT NULL, path TEXT NOT NULL, '
+            'file_id TEXT NOT NULL, PRIMARY KEY (cluster, path))')
+        self.db.commit()
+
+    def get(self, paths):
+        found = {}
+        paths = list(paths)
+        for index in range(0, len(paths), 500):
+            chunk = paths[index:index + 500]
+            rows = self.db.execute(f'SELECT path, file_id FROM paths WHERE cluster = ? AND path IN ({",".join("?" * len(chunk))})',
+                [self.cluster] + chunk)
+            found.update(rows)
+        return found
+
+    def put(self, pairs):
+        self.db.executemany('INSERT OR REPLACE INTO paths (cluster, path, file_id) VALUES (?, ?, ?)',
+            [(self.cluster, fs_path, file_id) for fs_path, file_id in pairs])
+        self.db.commit()
+
+    def delete(self, paths):
+        self.db.executemany('DELETE FROM paths WHERE cluster = ? AND path = ?', [(self.cluster, fs_path) for fs_path in paths])
+        self.db.commit()
+
+def same_path(first, second):
+    return (first.rstrip('/') or '/') == (second.rstrip('/') or '/')
+
+class PathResolver:
+    '''Memoized file id <-> path lookups for one cluster session.
+
+    Ids are turned into paths with resolve_paths, which takes a list of ids,
+    in chunks of `chunk_size`. There is no bulk call for the other direction,
+    so paths are looked up with get_file_attr, `workers` at a time. Both
+    directions share one cache, and failed lookups are not cached.
+
+    With a PathCache, paths found in it are checked with one batched
+    resolve_paths instead of a get_file_attr each, and are only looked up
+    again when their file id no longer resolves to the same path.
+    '''
+    def __init__(self, rc, workers=8, chunk_size=1000, cache=None):
+        self.rc = rc
+        self.cache = cache
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.lock = threading.Lock()
+        self.paths_by_id = {}
+        self.ids_by_path = {}
+
+    def remember(self, file_id, fs_path):
+        with self.lock:
+            self.paths_by_id[file_id] = fs_path
+            if fs_path:
+                self.ids_by_path[fs_path] = file_id
+
+    def paths(self, ids):
+        '''Return {file_id: path} for ids; unknown ids map to the empty path the API returns'''
+        missing = list(dict.fromkeys(file_id for file_id in ids if file_id not in self.paths_by_id))
+        for index in range(0, len(missing), self.chunk_size):
+            for entry in self.rc.fs.resolve_paths(ids=missing[index:index + self.chunk_size]):
+                self.remember(entry['id'], entry['path'])
+        logging.debug(f'{len(missing)} file ids were resolved in {-(-len(missing) // self.chunk_size)} requests')
+        return {file_id: self.paths_by_id.get(file_id) for file_id in ids}
+
+    def ids(self, paths):
+        '''Return {path: (file_id, error)} for paths, with error None when the lookup worked'''
+        missing = list(dict.fromkeys(fs_path for fs_path in paths if fs_path not in self.ids_by_path))
+        if self.cache is not None and missing:
+            cached = self.cache.get(missing)
+            current = self.paths(list(set(cached.values())))
+            stale = [fs_path for fs_path, file_id in cached.items() if not same_path(current[file_id] or '', fs_path)]
+            self.cache.delete(stale)
+            for fs_path, file_id in cached.items():
+                if fs_path not in stale:
+                    self.remember(file_id, fs_path)
+            logging.debug(f'{len(cached) - len(stale)} paths were found in the path cache, {len(stale)} were stale')
+            missing = [fs_path for fs_path in missing if fs_path not in self.ids_by_path]
+        results = run_parallel(self.rc, lambda rc, fs_path: rc.fs.get_file_attr(fs_path)['id'], missing, self.workers)
+        errors = {}
+        for fs_path, (file_id, error) in zip(missing, results):
+            if error is None:
+                self.remember(file_id, fs_path)
+            else:
+                errors[fs_path] = error
+        logging.debug(f'{len(missing) - len(errors)} of {len(missing)} paths were resolved')
+        if self.cache is not None:
+            self.cache.put([(fs_path, self.ids_by_path[fs_path]) for fs_path in missing if fs_path not in errors])
+        return {fs_path: (self.ids_by_path.get(fs_path), errors.get(fs_path)) for fs_path in paths}
+
+def create_directories(rc, paths, workers=8):
+    '''Create the directories in paths, with any of their parents that are missing.
+
+    All paths are merged into one tree, so a parent shared by many paths is
+    created once, and the tree is created one depth at a time with up to
+    `workers` requests in parallel within each depth. A directory that
+    already exists is left as it is. Returns {path: (file_id, error)}; the
+    directories below one that couldn't be created are not tried.
+    '''
+    levels = {}
+    for fs_path in paths:
+        parts = [part for part in fs_path.split('/') if part]
+        for depth in range(1, len(parts) + 1):
+            levels.setdefault(depth, set()).add('/' + '/'.join(parts[:depth]))
+
+    def create(client, directory):
+        parent, name = directory.rsplit('/', 1)
+        try:
+            return client.fs.create_directory(name=name, dir_path=parent or '/')['id']
+        except qumulo.lib.request.RequestError as excpt:
+            if excpt.error_class != 'fs_entry_exists_error':
+                raise
+            return None
+
+    ids = {}
+    errors = {}
+    for depth in sorted(levels):
+        directories = []
+        for directory in sorted(levels[depth]):
+            parent = directory.rsplit('/', 1)[0]
+            if parent in errors:
+                errors[directory] = errors[parent]
+            else:
+                directories.append(directory)
+        failed = 0
+        for directory, (file_id, error) in zip(directories, run_parallel(rc, create, directories, workers)):
+            if error is None:
+                ids[directory] = file_id
+            else:
+                errors[directory] = error
+                failed += 1
+        logging.debug(f'{len(directories) - failed} of {len(directories)} directories at depth {depth} were created or already existed')
+
+    # Only the ids of the requested directories that already existed are
+    # looked up; the parents don't need one.
+    leaves = {fs_path: fs_path.rstrip('/') or '/' for fs_path in paths}
+    existing = [directory for directory in dict.fromkeys(leaves.values()) if directory in ids and ids[directory] is None]
+    for directory, (file_id, error) in zip(existing, run_parallel(rc, lambda client, directory: client.fs.get_file_attr(directory)['id'], existing, workers)):
+        ids[directory] = file_id
+        if error is not None:
+            errors[directory] = error
+    return {fs_path: (ids.get(directory), errors.get(directory)) for fs_path, directory in leaves.items()}
+
+class Journal:
+    '''Append-only list of the items a set run has completed on one cluster.
+
+    Every completed item is written as one JSON line as soon as it is done;
+    the file is fsynced every `batch` items or `interval` seconds, and when
+    the run ends. A run started with resume=True skips the items already in
+    the journal; otherwise the journal is started over.
+    '''
+    def __init__(self, module, rc, resume=False, batch=100, interval=1.0):
+        self.file_name = f'{module}_journal.jsonl'
+        self.cluster = f'{rc.conninfo.host}:{rc.conninfo.port}'
+        self.batch = batch
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.completed = set()
+        self.recorded = 0
+        self.pending = 0
+        self.synced = time.monotonic()
+        if resume and os.path.exists(self.file_name):
+            self.load()
+            self.journal_file = open(self.file_name, 'a')
+        else:
+            if resume:
+                logging.info(f'{self.file_name} does not exist, nothing to resume')
+            self.journal_file = open(self.file_name, 'w')
+            self.journal_file.write(json.dumps({"module" : module, "cluster" : self.cluster}) + '\n')
+            self.sync()
+        atexit.register(self.close)
+
+    def load(self):
+        journal_file = open(self.file_name, 'rb')
+        header = json.loads(journal_file.readline())
+        if header['cluster'] != self.cluster:
+            logging.error(f'{self.file_name} was written for {header["cluster"]}, not for {self.cluster}')
+            sys.exit(2)
+        complete = journal_file.tell()
+        for line in journal_file:
+            if not line.endswith(b'\n'):
+                # The run died while writing its last line
+                break
+            complete += len(line)
+            try:
+                self.completed.add(json.loads(line)['key'])
+            except (ValueError, KeyError):
+                logging.warning(f'A broken line in {self.file_name} was ignored: {line!r}')
+        journal_file.close()
+        # A cut short last line is dropped, so the next record starts on a
+        # line of its own.
+        if complete < os.path.getsize(self.file_name):
+            os.truncate(self.file_name, complete)
+        logging.info(f'{len(self.completed)} items completed by an earlier run were found in {self.file_name}, they will be skipped')
+
+    def done(self, key):
+        return key in self.completed
+
+    def record(self, key):
+        with self.lock:
+            self.journal_file.write(json.dumps({"key" : key}) + '\n')
+            self.journal_file.flush()
+            self.completed.add(key)
+            self.recorded += 1
+            self.pending += 1
+            if self.pending >= self.batch or time.monotonic() - self.synced >= self.interval:
+                self.sync()
+
+    def sync(self):
+        self.journal_file.flush()
+        os.fsync(self.journal_file.fileno())
+        self.pending = 0
+        self.synced = time.monotonic()
+
+    def close(self):
+        with self.lock:
+            if not self.journal_file.closed:
+                self.sync()
+                self.journal_file.close()
+
+# --format values -> dump file name suffix
+DUMP_FORMATS = {
+    'json' : '.json',
+    'jsonl' : '.jsonl',
+    'jsonl.gz' : '.jsonl.gz',
+    'jsonl.zst' : '.jsonl.zst'
+}
+
+def dump_file_name(name, dump_format='json'):
+    return name + DUMP_FORMATS[dump_format]
+
+def open_dump(file_name, mode='r'):
+    '''Open a dump file in text mode for reading ("r") or writing ("w"), compressed by its suffix'''
+    if file_name.endswith('.gz'):
+        return gzip.open(file_name, mode + 't', encoding='utf-8')
+    if file_name.endswith('.zst'):
+        if zstandard is None:
+            logging.error(f'{file_name} needs the zstandard package: pip install zstandard')
+            sys.exit(2)
+        raw_file = open(file_name, mode + 'b')
+        if mode == 'w':
+            stream = zstandard.ZstdCompressor().stream_writer(raw_file, closefd=True)
+        else:
+            stream = zstandard.ZstdDecompressor().stream_reader(raw_file, closefd=True)
+        return io.TextIOWrapper(stream, encoding='utf-8')
+    return open(file_name, mode)
+
+class DumpWriter:
+    '''Write dump records one at a time.
+
+    The json format keeps the layout json.dump(records, indent=4) always had;
+    the other formats write one record per line, optionally compressed.
+    With a key function, the offset and length of every record in the
+    uncompressed stream are also written into a <dump file>.idx sidecar, so
+    load_records can read only the records it is asked for.
+    '''
+    def __init__(self, name, dump_format='json', key=None):
+        self.file_name = dump_file_name(name, dump_format)
+        self.json_array = dump_format == 'json'
+        self.dump_file = open_dump(self.file_name, 'w')
+        self.key = key
+        self.index_file = open(self.file_name + '.idx', 'w') if key is not None else None
+        self.count = 0
+        # json.dumps escapes everything outside ASCII, so characters are bytes
+        self.offset = 0
+        if self.json_array:
+            self.emit('[')
+
+    def emit(self, text):
+        self.dump_file.write(text)
+        self.offset += len(text)
+
+    def write(self, record):
+        if self.json_array:
+            self.emit(',\n' if self.count > 0 else '\n')
+            text = textwrap.indent(json.dumps(record, indent=4), '    ')
+        else:
+            text = json.dumps(record)
+        if self.index_file is not None:
+            self.index_file.write(f'{self.offset}\t{len(text)}\t{json.dumps(self.key(record))}\n')
+        self.emit(text if self.json_array else text + '\n')
+        self.count += 1
+
+    def flush(self):
+        self.dump_file.flush()
+
+    def close(self):
+        if self.json_array:
+            self.emit('\n]' if self.count > 0 else ']')
+        self.dump_file.close()
+        if self.index_file is not None:
+            # The dump size closes the index; an index without it, or for a
+            # dump of another size, is not used.
+            self.index_file.write(f'size\t{os.path.getsize(self.file_name)}\n')
+            self.index_file.close()
+
+def key_matches(key, patterns):
+    '''True if key starts with one of patterns, or matches it when it is a glob'''
+    for pattern in patterns:
+        if any(char in pattern for char in '*?['):
+            if fnmatch.fnmatchcase(key, pattern):
+                return True
+        elif key.startswith(pattern):
+            return True
+    return False
+
+def path_under(fs_path, prefix):
+    '''True if fs_path is the directory prefix or anything below it'''
+    prefix = prefix.rstrip('/')
+    fs_path = fs_path.rstrip('/')
+    return prefix == '' or fs_path == prefix or fs_path.startswith(prefix + '/')
+
+class DumpScope:
+    '''The part of a cluster a dump covers: tenant names, fs_path prefixes and
+    name patterns (prefixes or globs, as for --only).
+
+    The listing APIs can't filter, so objects are checked with includes() as
+    soon as they are listed, before anything else is fetched or written for
+    them. A criterion is only checked when the scope has it and the object
+    has the field; None means the field isn't known yet.
+    '''
+    def __init__(self, tenants=None, paths=None, names=None):
+        self.tenants = tenants or []
+        self.paths = paths or []
+        self.names = names or []
+
+    def includes(self, tenant=None, fs_path=None, name=None):
+        if self.tenants and tenant is not None and tenant not in self.tenants:
+            return False
+        if self.paths and fs_path is not None and not any(path_under(fs_path, prefix) for prefix in self.paths):
+            return False
+        if self.names and name is not None and not key_matches(name, self.names):
+            return False
+        return True
+
+def read_index(file_name, only):
+    '''Return (records in the dump, [(offset, length)] of those whose key matches only)
+    from the sidecar index of a dump, or None if there is no usable index'''
+    if not os.path.exists(file_name + '.idx'):
+        return None
+    # One "offset<TAB>length<TAB>JSON quoted key" line per record, then
+    # "size<TAB>dump file size"
+    count = 0
+    selected = []
+    index_file = open(file_name + '.idx', 'r')
+    for line in index_file:
+        fields = line.rstrip('\n').split('\t', 2)
+        if fields[0] == 'size':
+            index_file.close()
+            if int(fields[1]) != os.path.getsize(file_name):
+                logging.warning(f'{file_name}.idx does not belong to {file_name}, it is not used')
+                return None
+            return count, selected
+        count += 1
+        offset, length, key = fields
+        # Keys without escapes, which is nearly all of them, skip the JSON parser
+        if key_matches(key[1:-1] if '\\' not in key else json.loads(key), only):
+            selected.append((int(offset), int(length)))
+    index_file.close()
+    logging.warning(f'{file_name}.idx is incomplete, it is not used')
+    return None
+
+def load_records(name, dump_format='json', only=None, key=None):
+    '''Yield the records of a dump written by DumpWriter one at a time.
+
+    With only (a list of key prefixes or globs), just the records whose key
+    matches are yielded. When the dump has a usable index they are read at
+    their offsets, through mmap for uncompressed dumps; otherwise the whole
+    dump is read and key(record) is matched.
+    '''
+    file_name = dump_file_name(name, dump_format)
+    index = read_index(file_name, only) if only else None
+    if index is not None:
+        count, selected = index
+        logging.info(f'{len(selected)} of {count} records in {file_name} match {", ".join(only)}')
+        yield from read_at_offsets(file_name, selected)
+        return
+
+    dump_file = open_dump(file_name, 'r')
+    try:
+        if dump_format == 'json':
+            records = json.loads(dump_file.read())
+        else:
+            # Only one line is held in memory at a time
+            records = (json.loads(line) for line in dump_file if line.strip())
+        for record in records:
+            if not only or key_matches(key(record), only):
+                yield record
+    finally:
+        dump_file.close()
+
+def read_at_offsets(file_name, selected):
+    if selected == []:
+        return
+    if file_name.endswith('.gz') or file_name.endswith('.zst'):
+        # Compressed streams can only be read forward, so the records are
+        # read in file order and everything in between is skipped unparsed.
+        text_file = open_dump(file_name, 'r')
+        dump_file = text_file.buffer
+        try:
+            position = 0
+            for offset, length in sorted(selected):
+                while position < offset:
+                    position += len(dump_file.read(min(offset - position, 1024 ** 2)))
+                yield json.loads(dump_file.read(length))
+                position += length
+        finally:
+            text_file.close()
+        return
+    dump_file = open(file_name, 'rb')
+    dump_map = mmap.mmap(dump_file.fileno(), 0, access=mmap.ACCESS_READ)
+    try:
+        for offset, length in selected:
+            yield json.loads(dump_map[offset:offset + length])
+    finally:
+        dump_map.close()
+        dump_file.close()
+
+def write_plan(file_name, module, rc, actions):
+    '''Write the changeset computed for a destination cluster into a plan file'''
+    summary = {}
+    for action in actions:
+        summary[action['action']] = summary.get(action['action'], 0) + 1
+    plan = {
+        "module" : module,
+        "cluster_address" : rc.conninfo.host,
+        "created" : time.strftime('%Y-%m-%dT%H:%M:%S'),
+        "summary" : summary,
+        "actions" : actions
+    }
+    plan_file = open(file_name, 'w')
+    json.dump(plan, plan_file, indent=4)
+    plan_file.close()
+    logging.info(f'The {module} plan was written into {file_name}: {summary}')
+
+def read_plan(file_name, module, rc):
+    '''Return the actions of a plan file written by write_plan for this module and cluster'''
+    plan_file = open(file_name, 'r')
+    plan = json.loads(plan_file.read())
+    plan_file.close()
+    if plan['module'] != module:
+        logging.error(f'{file_name} is a {plan["module"]} plan, not a {module} plan')
+        sys.exit(2)
+    if plan['cluster_address'] != rc.conninfo.host:
+        logging.error(f'{file_name} was planned for {plan["cluster_address"]}, not {rc.conninfo.host}')
+        sys.exit(2)
+    logging.info(f'The {module} plan from {file_name} is being applied: {plan["summary"]}')
+    return plan['actions']
+
+class ApiMetrics:
+    '''Call counts, response sizes, latencies and errors per API function'''
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.endpoints = {}
+        self.started = time.time()
+
+    def record(self, name, seconds, size=0, error=None):
+        with self.lock:
+            endpoint = self.endpoints.setdefault(name, {'latencies': [], 'bytes': 0, 'errors': {}})
+            endpoint['latencies'].append(seconds)
+            endpoint['bytes'] += size
+            if error is not None:
+                if isinstance(error, qumulo.lib.request.RequestError):
+                    key = str(error.status_code)
+                else:
+                    key = type(error).__name__
+                endpoint['errors'][key] = endpoint['errors'].get(key, 0) + 1
+
+    def summary(self):
+        rows = []
+        with self.lock:
+            for name, endpoint in self.endpoints.items():
+                latencies = sorted(endpoint['latencies'])
+                def percentile(p):
+                    return latencies[min(len(latencies) - 1, int(p * len(latencies)))]
+                rows.append({
+                    "endpoint" : name,
+                    "calls" : len(latencies),
+                    "errors" : endpoint['errors'],
+                    "bytes" : endpoint['bytes'],
+                    "total_seconds" : round(sum(latencies), 6),
+                    "p50_ms" : round(percentile(0.50) * 1000, 3),
+                    "p90_ms" : round(percentile(0.90) * 1000, 3),
+                    "p99_ms" : round(percentile(0.99) * 1000, 3),
+                    "max_ms" : round(latencies[-1] * 1000, 3)
+                    })
+        rows.sort(key=lambda row: row['total_seconds'], reverse=True)
+        return rows
+
+    def report(self, file_name):
+        rows = self.summary()
+        print()
+        print(f'{"endpoint":<45} {"calls":>8} {"errors":>7} {"KiB":>10} {"total s":>9} {"p50 ms":>8} {"p90 ms":>8} {"p99 ms":>8} {"max ms":>8}')
+        for row in rows:
+            print(f'{row["endpoint"]:<45} {row["calls"]:>8} {sum(row["errors"].values()):>7} {row["bytes"] / 1024:>10.1f} '
+                f'{row["total_seconds"]:>9.3f} {row["p50_ms"]:>8.1f} {row["p90_ms"]:>8.1f} {row["p99_ms"]:>8.1f} {row["max_ms"]:>8.1f}')
+        print(f'Totally {sum(row["calls"] for row in rows)} API calls in {time.time() - self.started:.1f} seconds')
+        metrics_file = open(file_name, 'w')
+        json.dump({"wall_seconds" : round(time.time() - self.started, 3), "endpoints" : rows}, metrics_file, indent=4)
+        metrics_file.close()
+        logging.info(f'API metrics were written into {file_name}')
+
+def response_size(result):
+    # Responses are already decoded by the bindings; their JSON encoding is a
+    # close enough measure of how much each endpoint returned.
+    try:
+        return len(json.dumps(result, default=str))
+    except (TypeError, ValueError):
+        return 0
+
+RETRY_ATTEMPTS = 5
+RETRY_BASE_SECONDS = 0.5
+RETRY_MAX_SECONDS = 30
+
+# Creates are not idempotent: one that reached the cluster but lost its
+# response would make a duplicate, or fail with 409, if it were sent again.
+NOT_IDEMPOTENT = re.compile(r'\.(\w+_)?(add|create|join)_')
+
+def is_retryable(error, idempotent=True):
+    '''5xx and 429 responses, timeouts and dropped connections are worth another
+    try. A call that isn't idempotent is only sent again when the cluster
+    surely didn't act on it: it refused the connection, or answered 429 or 503.
+    '''
+    if isinstance(error, qumulo.lib.request.RequestError):
+        if not idempotent:
+            return error.status_code in (429, 503)
+        return error.status_code >= 500 or error.status_code == 429
+    if not idempotent:
+        return isinstance(error, ConnectionRefusedError)
+    return isinstance(error, (ConnectionError, TimeoutError, http.client.HTTPException))
+
+def error_summary(error):
+    if isinstance(error, qumulo.lib.request.RequestError):
+        return f'{error.status_code} {error.error_class}'
+    return f'{type(error).__name__}: {error}'
+
+def send_with_retries(send, name, rc, metrics):
+    '''Return (result, seconds) of send(), retrying transient errors with full jitter backoff'''
+    idempotent = NOT_IDEMPOTENT.search(name) is None
+    attempt = 0
+    while True:
+        start = time.perf_counter()
+        try:
+            result = send()
+        except StopIteration:
+            raise
+        except Exception as excpt:
+            seconds = time.perf_counter() - start
+            if metrics is not None:
+                metrics.record(name, seconds, error=excpt)
+            retryable = is_retryable(excpt, idempotent)
+            # The limiter backs off on every transient error, retried or not
+            report_call(seconds, is_retryable(excpt))
+            attempt += 1
+            if not retryable or attempt >= RETRY_ATTEMPTS:
+                raise
+            delay = random.uniform(0, min(RETRY_MAX_SECONDS, RETRY_BASE_SECONDS * 2 ** (attempt - 1)))
+            logging.warning(f'{name} failed with {error_summary(excpt)}, retry {attempt} of {RETRY_ATTEMPTS - 1} in {delay:.1f} seconds')
+            if not isinstance(excpt, qumulo.lib.request.RequestError):
+                # The connection can't be reused after a transport error
+                rc.refresh_connection()
+            time.sleep(delay)
+            continue
+        seconds = time.perf_counter() - start
+        report_call(seconds, False)
+        return result, seconds
+
+class InstrumentedIterator:
+    '''Retries and records every page fetched by a paging iterator as one call'''
+    def __init__(self, iterator, name, rc, metrics):
+        self.iterator = iterator
+        self.name = name
+        self.rc = rc
+        self.metrics = metrics
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        # A paging iterator only moves to the next page after a successful
+        # request, so a failed page can simply be asked for again.
+        page, seconds = send_with_retries(lambda: next(self.iterator), self.name, self.rc, self.metrics)
+        if self.metrics is not None:
+            self.metrics.record(self.name, seconds, response_size(page))
+        return page
+
+def instrumented_call(func, name, rc, metrics):
+    def call(*args, **kwargs):
+        result, seconds = send_with_retries(lambda: func(*args, **kwargs), name, rc, metrics)
+        if isinstance(result, collections.abc.Iterator):
+            return InstrumentedIterator(result, name, rc, metrics)
+        if metrics is not None:
+            metrics.record(name, seconds, response_size(result))
+        return result
+    return call
+
+class InstrumentedSection:
+    def __init__(self, section, section_name, rc, metrics):
+        self.section = section
+        self.section_name = section_name
+        self.rc = rc
+        self.metrics = metrics
+
+    def __getattr__(self, name):
+        attr = getattr(self.section, name)
+        if callable(attr):
+            return instrumented_call(attr, f'{self.section_name}.{name}', self.rc, self.metrics)
+        return attr
+
+class InstrumentedClient:
+    '''Wraps a RestClient so every API call made through it is retried on
+    transient errors and, when profiling is enabled, recorded in metrics'''
+    def __init__(self, rc, metrics=None):
+        self.rc = rc
+        self.metrics = metrics
+
+    def __getattr__(self, name):
+        attr = getattr(self.rc, name)
+        if name in ('conninfo', 'credentials', 'port', 'Error', 'close', 'refresh_connection') or attr is None:
+            return attr
+        if callable(attr):
+            return instrumented_call(attr, name, self.rc, self.metrics)
+        return InstrumentedSection(attr, name, self.rc, self.metrics)
+
+    def clone(self):
+        return InstrumentedClient(self.rc.clone(), self.metrics)
+
+# node_balancing values in credentials.json
+NODE_BALANCING = ('round-robin', 'least-outstanding')
+
+# How long a node that stopped responding gets no new calls
+NODE_DOWN_SECONDS = 30
+
+class NodeBalancer:
+    '''Picks the cluster node for every API call, round-robin or the node with
+    the fewest calls in flight. A node whose call failed with a transport
+    error gets no new calls for NODE_DOWN_SECONDS, unless all nodes are down.
+    Shared by all the clones of one NodeBalancedClient.
+    '''
+    def __init__(self, addresses, policy='round-robin'):
+        self.addresses = addresses
+        self.policy = policy
+        self.lock = threading.Lock()
+        self.outstanding = [0] * len(addresses)
+        self.calls = [0] * len(addresses)
+        self.down_until = [0.0] * len(addresses)
+        self.next = 0
+
+    def acquire(self, node=None):
+        '''Return the node of the next call, or count one more call on node'''
+        with self.lock:
+            if node is not None:
+                self.outstanding[node] += 1
+                self.calls[node] += 1
+                return node
+            now = time.monotonic()
+            nodes = [node for node in range(len(self.addresses)) if self.down_until[node] <= now]
+            if nodes == []:
+                nodes = list(range(len(self.addresses)))
+            # Ties, and every pick for round-robin, go to the next node in turn
+            turn = lambda node: (node - self.next) % len(self.addresses)
+            if self.policy == 'least-outstanding':
+                node = min(nodes, key=lambda node: (self.outstanding[node], turn(node)))
+            else:
+                node = min(nodes, key=turn)
+            self.next = node + 1
+            self.outstanding[node] += 1
+            self.calls[node] += 1
+            return node
+
+    def release(self, node, down=False):
+        with self.lock:
+            self.outstanding[node] -= 1
+            # Only the first of the calls that were in flight on the node reports it
+            was_up = self.down_until[node] <= time.monotonic()
+            if down:
+                self.down_until[node] = time.monotonic() + NODE_DOWN_SECONDS
+        if down and was_up:
+            logging.warning(f'Node {self.addresses[node]} stopped responding, its calls go to the other nodes for {NODE_DOWN_SECONDS} seconds')
+
+    def report(self):
+        logging.info('API calls per node: ' + ', '.join(f'{address} {calls}' for address, calls in zip(self.addresses, self.calls)))
+
+class NodeBalancedSection:
+    def __init__(self, client, section_name):
+        self.client = client
+        self.section_name = section_name
+
+    def __getattr__(self, name):
+        attr = getattr(getattr(self.client.clients[0], self.section_name), name)
+        if callable(attr):
+            return lambda *args, **kwargs: self.client.call(self.section_name, name, args, kwargs)
+        return attr
+
+class NodeBalancedClient:
+    '''Sends every API call of a logged in RestClient to one of the cluster nodes.
+
+    There is one RestClient per node, all with the session of rc, and the
+    node of every call is picked by a NodeBalancer. rc itself only stands for
+    the cluster, for example in journals and the path cache. A failed call is
+    not retried here: InstrumentedClient retries it, on another node if this
+    one stopped responding.
+    '''
+    def __init__(self, rc, clients, balancer):
+        self.rc = rc
+        self.clients = clients
+        self.balancer = balancer
+        self.failed = None
+
+    def __getattr__(self, name):
+        if name in ('conninfo', 'credentials', 'port', 'Error'):
+            return getattr(self.rc, name)
+        attr = getattr(self.clients[0], name)
+        if attr is None:
+            return attr
+        if callable(attr):
+            return lambda *args, **kwargs: self.call(None, name, args, kwargs)
+        return NodeBalancedSection(self, name)
+
+    def send(self, send, node=None):
+        node = self.balancer.acquire(node)
+        try:
+            result = send(self.clients[node])
+        except Exception as excpt:
+            # An error response means the node is up
+            down = is_retryable(excpt) and not isinstance(excpt, qumulo.lib.request.RequestError)
+            self.balancer.release(node, down)
+            if down:
+                self.failed = node
+            raise
+        self.balancer.release(node)
+        return node, result
+
+    def call(self, section_name, name, args, kwargs):
+        def send(client):
+            target = client if section_name is None else getattr(client, section_name)
+            return getattr(target, name)(*args, **kwargs)
+        node, result = self.send(send)
+        if isinstance(result, collections.abc.Iterator):
+            return NodeBalancedIterator(self, result, node)
+        return result
+
+    def refresh_connection(self):
+        if self.failed is not None:
+            self.clients[self.failed].refresh_connection()
+            self.failed = None
+
+    def clone(self):
+        return NodeBalancedClient(self.rc, [client.clone() for client in self.clients], self.balancer)
+
+class NodeBalancedIterator:
+    '''Fetches the pages of a paging iterator from the node that sent the first
+    one, through its connection, so a failed page resets that connection'''
+    def __init__(self, client, iterator, node):
+        self.client = client
+        self.iterator = iterator
+        self.node = node
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self.client.send(lambda client: next(self.iterator), self.node)[1]
+
+def node_addresses(rc):
+    '''Return the first address of every node of the cluster, in node order'''
+    addresses = []
+    for node in rc.network.list_network_status_v2():
+        for status in node['network_statuses']:
+            if status['address'] and status['address'] not in addresses:
+                addresses.append(status['address'])
+                break
+    return addresses
+
+def balance_nodes(rc, policy='round-robin'):
+    '''Return a client that spreads the API calls of the logged in rc over all nodes of its cluster'''
+    if policy not in NODE_BALANCING:
+        logging.error(f'Unknown node_balancing {policy}, it can be {" or ".join(NODE_BALANCING)}')
+        sys.exit(2)
+    try:
+        addresses = node_addresses(rc)
+    except Exception as excpt:
+        logging.warning(f'The nodes of {rc.conninfo.host} couldn\'t be listed, all calls go to it: {excpt}')
+        return rc
+    if len(addresses) < 2:
+        return rc
+    clients = []
+    for address in addresses:
+        if address == rc.conninfo.host:
+            clients.append(rc)
+        else:
+            clients.append(qumulo.rest_client.RestClient(address, rc.conninfo.port, rc.conninfo.credentials, rc.conninfo.timeout))
+    balancer = NodeBalancer(addresses, policy)
+    atexit.register(balancer.report)
+    logging.info(f'API calls to {rc.conninfo.host} are spread over {len(addresses)} nodes ({policy}): {", ".join(addresses)}')
+    return NodeBalancedClient(rc, clients, balancer)
+
+api_metrics = None
+
+def enable_profiling(file_name):
+    '''Record every API call made through instrument()ed clients and report them at exit'''
+    global api_metrics
+    api_metrics = ApiMetrics()
+    atexit.register(api_metrics.report, file_name)
+
+def instrument(rc, node_balancing=None):
+    if node_balancing:
+        rc = balance_nodes(rc, node_balancing)
+    return InstrumentedClient(rc, api_metrics)
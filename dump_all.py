@@ -0,0 +1,146 @@
+import sys
+import time
+import logging
+import getopt
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from common import TenantMap, DumpScope, enable_profiling, DUMP_FORMATS
+from quotas import login, quota_list
+from users import users_list
+from nfs_exports import nfs_list
+from smb_shares import smb_list
+from others import others_list
+
+def main(argv):
+    # Logging Details
+    logging.basicConfig(filename='operation.log', level=logging.DEBUG,
+        format='%(asctime)s,%(levelname)s,%(message)s')
+    # define a Handler which writes INFO messages or higher to the sys.stderr
+    console = logging.StreamHandler()
+    console.setLevel(logging.INFO)
+    # add the handler to the root logger
+    logging.getLogger('').addHandler(console)
+
+    # Argument Parameters Details
+    err_msg = '''
+usage: dump_all.py [--format FORMAT] [--jsonl] [--workers N] [--profile] [--sections LIST] [--tenant NAME] [--path PREFIX] [--name PATTERN]
+
+Dump NFS exports, SMB shares, quotas, users and the other cluster settings of the primary cluster in one run.
+
+optional arguments:
+-h, --help          Show this help message and exit
+--format FORMAT     Dump file format for quotas, users, NFS exports and SMB shares: json (default), jsonl, jsonl.gz or jsonl.zst.
+--jsonl             Same as --format jsonl.
+--workers N         Number of parallel SMB share detail requests (default: 8).
+--profile           Print per-endpoint API call counts and latencies at exit and write them into dump_all_profile.json.
+--sections LIST     Comma separated subset of nfs,smb,quotas,users,others (default: all).
+--tenant NAME       Only dump the NFS exports and SMB shares of this tenant. Can be given more than once.
+--path PREFIX       Only dump the NFS exports, SMB shares and quotas whose file system path is PREFIX or below it. Can be given more than once.
+--name PATTERN      Only dump the NFS exports, SMB shares and users whose export path, share name or user name starts with PATTERN, or matches it when it contains *, ? or [. Can be given more than once.
+    '''
+    try:
+        opts, args = getopt.getopt(argv,'h',["help","format=","jsonl","workers=","profile","sections=","tenant=","path=","name="])
+    except getopt.GetoptError:
+        print (err_msg)
+        sys.exit(2)
+
+    dump_format = 'json'
+    workers = 8
+    sections = list(SECTIONS)
+    scope_tenants = []
+    scope_paths = []
+    scope_names = []
+    for opt, arg in opts:
+        if opt in ("-h","--help"):
+            print (err_msg)
+            sys.exit()
+        elif opt == "--format":
+            if arg not in DUMP_FORMATS:
+                print (err_msg)
+                sys.exit(2)
+            dump_format = arg
+        elif opt == "--jsonl":
+            dump_format = 'jsonl'
+        elif opt == "--workers":
+            try:
+                workers = max(1, int(arg))
+            except ValueError:
+                print (err_msg)
+                sys.exit(2)
+        elif opt == "--profile":
+            enable_profiling('dump_all_profile.json')
+        elif opt == "--sections":
+            sections = arg.split(',')
+            for section in sections:
+                if section not in SECTIONS:
+                    print (f'Unknown section: {section}')
+                    sys.exit(2)
+        elif opt == "--tenant":
+            scope_tenants.append(arg)
+        elif opt == "--path":
+            scope_paths.append(arg)
+        elif opt == "--name":
+            scope_names.append(arg)
+
+    prc = login('primary')
+    print ()
+    results = dump_all(prc, sections, dump_format, workers, DumpScope(scope_tenants, scope_paths, scope_names))
+    print_report(results)
+    if any(result['error'] is not None for result in results.values()):
+        sys.exit(1)
+
+# section name -> function(rc, tenants, dump_format, workers, scope)
+# The other cluster settings are always dumped in full.
+SECTIONS = {
+    'nfs' : lambda rc, tenants, dump_format, workers, scope: nfs_list(rc, tenants, dump_format, scope),
+    'smb' : lambda rc, tenants, dump_format, workers, scope: smb_list(rc, tenants, workers, dump_format, scope),
+    'quotas' : lambda rc, tenants, dump_format, workers, scope: quota_list(rc, dump_format, scope),
+    'users' : lambda rc, tenants, dump_format, workers, scope: users_list(rc, dump_format, scope),
+    'others' : lambda rc, tenants, dump_format, workers, scope: others_list(rc, tenants),
+}
+
+def dump_section(rc, section, tenants, dump_format, workers, scope=None):
+    start = time.perf_counter()
+    error = None
+    try:
+        failed = SECTIONS[section](rc, tenants, dump_format, workers, scope)
+        if failed:
+            error = f'{", ".join(failed)} could not be dumped'
+    except Exception as excpt:
+        error = excpt
+    return {"seconds" : time.perf_counter() - start, "error" : error}
+
+def dump_all(rc, sections, dump_format='json', workers=8, scope=None):
+    # Every section runs on its own clone of the single logged in session, so
+    # a full dump takes about as long as the slowest section. The tenant map
+    # is shared, so the tenant list is read once for all of them.
+    tenants = TenantMap(rc)
+    results = {}
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(sections)) as executor:
+        futures = {}
+        for section in sections:
+            logging.info(f'The {section} dump was started')
+            futures[executor.submit(dump_section, rc.clone(), section, tenants, dump_format, workers, scope)] = section
+        for future in as_completed(futures):
+            section = futures[future]
+            results[section] = future.result()
+            done = len(results)
+            if results[section]['error'] is None:
+                logging.info(f'The {section} dump was completed in {results[section]["seconds"]:.1f} seconds ({done}/{len(sections)})')
+            else:
+                logging.error(f'The {section} dump failed after {results[section]["seconds"]:.1f} seconds ({done}/{len(sections)})')
+                logging.error(f'Error: {results[section]["error"]}')
+    results['total'] = {"seconds" : time.perf_counter() - started, "error" : None}
+    return results
+
+def print_report(results):
+    print ()
+    print (f'{"section":<10} {"seconds":>9}  status')
+    for section, result in results.items():
+        status = 'OK' if result['error'] is None else f'FAILED: {result["error"]}'
+        if section == 'total':
+            status = ''
+        print (f'{section:<10} {result["seconds"]:>9.2f}  {status}')
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -0,0 +1,589 @@
+import sys
+import os
+import re
+import ssl
+import json
+import time
+import random
+import getopt
+import logging
+import tempfile
+import threading
+import subprocess
+from urllib.parse import urlsplit, parse_qs, unquote
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# A stand-in for the parts of the Qumulo REST API that the dump and set
+# scripts use. It keeps everything in memory, can add a fixed latency to
+# every request, can fail a share of requests with 503 and counts the requests it serves per endpoint, so the
+# scripts can be measured at scale without a real cluster.
+
+def main(argv):
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s,%(levelname)s,%(message)s')
+
+    err_msg = '''
+usage: mock_cluster.py [--port N] [--all-nodes] [--latency-ms N] [--error-rate P] [--quotas N] [--shares N] [--exports N] [--users N] [--policies N] [--tenants N]
+
+Serve a local mock Qumulo REST API filled with a synthetic dataset.
+Use "admin" / "Admin123" to log in. Request counts are returned by GET /_mock/stats.
+
+optional arguments:
+-h, --help          Show this help message and exit
+--port N            Port to listen on (default: 8000).
+--all-nodes         Listen on one loopback address per node (127.0.0.1, 127.0.0.2, ...) and report those as the node addresses.
+--latency-ms N      Delay added to every request, in milliseconds (default: 0).
+--error-rate P      Share of requests, between 0 and 1, answered with 503 Service Unavailable (default: 0).
+--quotas N          Number of directory quotas (default: 1000).
+--shares N          Number of SMB shares (default: 100).
+--exports N         Number of NFS exports (default: 100).
+--users N           Number of local users (default: 100).
+--policies N        Number of snapshot policies (default: 10).
+--tenants N         Number of tenants (default: 1).
+    '''
+    try:
+        opts, args = getopt.getopt(argv, 'h', ["help", "port=", "all-nodes", "latency-ms=", "error-rate=", "quotas=", "shares=",
+            "exports=", "users=", "policies=", "tenants="])
+    except getopt.GetoptError:
+        print (err_msg)
+        sys.exit(2)
+
+    port = 8000
+    all_nodes = False
+    latency = 0.0
+    error_rate = 0.0
+    sizes = {}
+    try:
+        for opt, arg in opts:
+            if opt in ("-h", "--help"):
+                print (err_msg)
+                sys.exit()
+            elif opt == "--port":
+                port = int(arg)
+            elif opt == "--all-nodes":
+                all_nodes = True
+            elif opt == "--latency-ms":
+                latency = int(arg) / 1000.0
+            elif opt == "--error-rate":
+                error_rate = float(arg)
+            else:
+                sizes[opt[2:]] = int(arg)
+    except ValueError:
+        print (err_msg)
+        sys.exit(2)
+
+    cluster = MockCluster(latency, error_rate)
+    cluster.all_nodes = all_nodes
+    cluster.generate(**sizes)
+    # With --all-nodes every node has an API server of its own, on its own
+    # loopback address, as on a real cluster
+    server = serve(cluster, port)
+    for node in cluster.nodes[1:] if all_nodes else []:
+        node_server = serve(cluster, server.server_address[1], cluster.node_address(node))
+        threading.Thread(target=node_server.serve_forever, daemon=True).start()
+    logging.info(f'Mock cluster is listening on port {server.server_address[1]}')
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+class MockError(Exception):
+    def __init__(self, status, error_class, description):
+        self.status = status
+        self.error_class = error_class
+        self.description = description
+
+def not_found(what):
+    return MockError(404, 'fs_no_such_entry_error', f'{what} not found')
+
+class MockCluster:
+    '''In-memory cluster state plus the request routing table'''
+    def __init__(self, latency=0.0, error_rate=0.0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.all_nodes = False
+        self.lock = threading.Lock()
+        self.stats_lock = threading.Lock()
+        self.routes = [
+            ('POST', r'/v1/session/login', self.login),
+            ('GET', r'/v1/files/quotas/status/', self.list_quotas),
+            ('GET', r'/v1/files/quotas/status/(?P<id_>[^/]+)', self.get_quota_status),
+            ('GET', r'/v1/files/quotas/(?P<id_>[^/]+)', self.get_quota),
+            ('POST', r'/v1/files/quotas/', self.create_quota),
+            ('PUT', r'/v1/files/quotas/(?P<id_>[^/]+)', self.update_quota),
+            ('POST', r'/v1/files/resolve', self.resolve_paths),
+            ('GET', r'/v1/files/(?P<ref>[^/]+)/info/attributes', self.get_file_attr),
+            ('POST', r'/v1/files/(?P<ref>[^/]+)/entries/', self.create_entry),
+            ('GET', r'/v1/users/', self.list_users),
+            ('POST', r'/v1/users/', self.add_user),
+            ('PUT', r'/v1/users/(?P<id_>\d+)', self.modify_user),
+            ('GET', r'/v3/nfs/exports/', self.list_exports),
+            ('POST', r'/v3/nfs/exports/', self.add_export),
+            ('PATCH', r'/v3/nfs/exports/(?P<id_>[^/]+)', self.modify_export),
+            ('GET', r'/v3/smb/shares/', self.list_shares),
+            ('GET', r'/v3/smb/shares/(?P<id_>[^/]+)', self.get_share),
+            ('POST', r'/v3/smb/shares/', self.add_share),
+            ('PATCH', r'/v3/smb/shares/(?P<id_>[^/]+)', self.modify_share),
+            ('GET', r'/v1/smb/settings', lambda request: self.smb_settings),
+            ('GET', r'/v1/multitenancy/tenants/', self.list_tenants),
+            ('GET', r'/v3/snapshots/policies/', self.list_policies),
+            ('POST', r'/v3/snapshots/policies/', self.create_policy),
+            ('GET', r'/v2/network/interfaces/', lambda request: self.interfaces),
+            ('PATCH', r'/v2/network/interfaces/(?P<id_>\d+)', self.modify_interface),
+            ('PUT', r'/v2/network/interfaces/(?P<id_>\d+)', self.modify_interface),
+            ('GET', r'/v2/network/interfaces/(?P<id_>\d+)/networks/', lambda request: self.networks),
+            ('POST', r'/v2/network/interfaces/(?P<id_>\d+)/networks/', self.add_network),
+            ('PATCH', r'/v2/network/interfaces/(?P<id_>\d+)/networks/(?P<network_id>\d+)', self.modify_network),
+            ('GET', r'/v2/network/interfaces/(?P<id_>\d+)/status/', self.network_status),
+            ('GET', r'/v1/cluster/nodes/', self.list_nodes),
+            ('GET', r'/v1/time/settings', lambda request: self.time_settings),
+            ('PATCH', r'/v1/time/settings', self.set_time),
+            ('GET', r'/v2/ldap/settings', lambda request: self.ldap_settings),
+            ('PUT', r'/v2/ldap/settings', self.set_ldap),
+            ('GET', r'/v1/auth/user-defined-mappings/', lambda request: self.user_mappings),
+            ('GET', r'/v1/ad/monitor', lambda request: self.ad_status),
+            ('POST', r'/v1/ad/join', self.join_ad),
+            ('GET', r'/v2/replication/source-relationships/status/', lambda request: self.replications),
+            ('POST', r'/v2/replication/source-relationships/', self.create_replication),
+        ]
+        self.routes = [(method, re.compile(pattern + '$'), handler) for method, pattern, handler in self.routes]
+        self.generate(quotas=0, shares=0, exports=0, users=0, policies=0)
+
+    ########### DATASET ###########
+    def generate(self, quotas=1000, shares=100, exports=100, users=100, policies=10, tenants=1,
+            nodes=4, with_objects=True):
+        '''Replace the cluster state with a synthetic dataset.
+
+        The directory tree is always created; with_objects=False leaves out
+        quotas, shares, exports, users and policies so the cluster can act as
+        an empty restore destination for the same dump.
+        '''
+        with self.lock:
+            self.next_id = 100
+            self.paths = {'/': '2'}
+            self.ids = {'2': '/'}
+            self.quotas = {}
+            self.exports = {}
+            self.shares = {}
+            self.users = {}
+            self.policies = {}
+            self.replications = []
+            self.tenants = [
+                {'id': i, 'name': 'Default' if i == 1 else f'tenant{i}', 'networks': [1],
+                 'nfs_enabled': True, 'replication_enabled': True, 'rest_api_enabled': True,
+                 'smb_enabled': True, 'ssh_enabled': True, 'web_ui_enabled': True,
+                 'identity_config_id': 1}
+                for i in range(1, tenants + 1)]
+            self.nodes = [{'id': i, 'node_name': f'mock-{i}', 'node_status': 'online'} for i in range(1, nodes + 1)]
+            self.users['500'] = self.user_record('500', 'admin', '', '513', None)
+            self.users['501'] = self.user_record('501', 'guest', '', '514', None)
+            self.smb_settings = {'session_encryption': 'NONE', 'supported_dialects': ['SMB2_DIALECT_2_002']}
+            self.time_settings = {'use_ad_for_primary': False, 'ntp_servers': ['pool.ntp.org']}
+            self.ldap_settings = {'use_ldap': False, 'bind_uri': '', 'user': '', 'base_distinguished_names': '',
+                'ldap_schema': 'RFC2307', 'ldap_schema_description': {}, 'encrypt_connection': True}
+            self.user_mappings = []
+            self.ad_status = {'status': 'NOT_IN_DOMAIN', 'domain': '', 'domain_netbios': '', 'ou': '',
+                'use_ad_posix_attributes': False, 'base_dn': ''}
+            self.interfaces = [{'id': 1, 'name': 'bond0', 'default_gateway': '10.0.0.1',
+                'default_gateway_ipv6': '', 'bonding_mode': 'IEEE_8023AD', 'mtu': 1500}]
+            self.networks = [{'id': 1, 'name': 'Default', 'assigned_by': 'STATIC', 'floating_ip_ranges': [],
+                'dns_servers': ['10.0.0.2'], 'dns_search_domains': [], 'ip_ranges': ['10.0.0.10-20'],
+                'netmask': '255.255.255.0', 'mtu': 1500, 'vlan_id': 0, 'tenant_id': 1}]
+
+            directory_count = max(quotas, shares, exports, policies)
+            for i in range(directory_count):
+                self.make_directory(f'/projects/p{i:06d}')
+            if not with_objects:
+                return
+            for i in range(quotas):
+                file_id = self.paths[f'/projects/p{i:06d}']
+                self.quotas[file_id] = str((i % 100 + 1) * 1024 ** 3)
+            for i in range(exports):
+                self.add_export_record({'export_path': f'/export{i:06d}', 'fs_path': f'/projects/p{i:06d}',
+                    'description': '', 'tenant_id': (i % tenants) + 1, 'fields_to_present_as_32_bit': [],
+                    'restrictions': [{'read_only': False, 'require_privileged_port': False,
+                        'host_restrictions': [], 'user_mapping': 'NFS_MAP_NONE',
+                        'map_to_user': {'id_type': 'LOCAL_USER', 'id_value': '0'}}]})
+            for i in range(shares):
+                self.add_share_record({'share_name': f'share{i:06d}', 'fs_path': f'/projects/p{i:06d}',
+                    'description': '', 'tenant_id': (i % tenants) + 1,
+                    'access_based_enumeration_enabled': False, 'default_file_create_mode': '0644',
+                    'default_directory_create_mode': '0755', 'require_encryption': False,
+                    'network_permissions': [{'type': 'ALLOWED', 'address_ranges': [], 'rights': ['ALL']}],
+                    'permissions': [{'type': 'ALLOWED', 'rights': ['ALL'], 'trustee': {
+                        'domain': 'WORLD', 'auth_id': '8589934592', 'uid': None, 'gid': None,
+                        'sid': 'S-1-1-0', 'name': 'Everyone'}}]})
+            for i in range(users):
+                user_id = str(1000 + i)
+                self.users[user_id] = self.user_record(user_id, f'user{i:06d}', str(2000 + i), '513', None)
+            for i in range(policies):
+                policy_id = str(i + 1)
+                self.policies[policy_id] = {'id': policy_id, 'policy_name': f'policy{i:06d}',
+                    'snapshot_name_template': '{ID}_{Policy}', 'enabled': True, 'lock_key_ref': None,
+                    'source_file_id': self.paths[f'/projects/p{i:06d}'],
+                    'schedule': {'id': 1, 'creation_schedule': {'frequency': 'SCHEDULE_DAILY_OR_WEEKLY',
+                        'hour': 0, 'minute': 0, 'on_days': ['SUN'], 'timezone': 'UTC'},
+                        'expiration_time_to_live': '7days'}}
+
+    def new_id(self):
+        self.next_id += 1
+        return str(self.next_id)
+
+    def make_directory(self, path):
+        parent = path.rsplit('/', 1)[0] or '/'
+        if parent not in self.paths:
+            self.make_directory(parent)
+        if path not in self.paths:
+            file_id = self.new_id()
+            self.paths[path] = file_id
+            self.ids[file_id] = path
+
+    def user_record(self, user_id, name, uid, primary_group, home_directory):
+        return {'id': user_id, 'name': name, 'uid': uid, 'primary_group': primary_group,
+            'home_directory': home_directory, 'sid': f'S-1-5-21-{user_id}', 'can_change_password': True}
+
+    def add_export_record(self, export):
+        export = dict(export, id=self.new_id())
+        self.exports[export['id']] = export
+        return export
+
+    def add_share_record(self, share):
+        share = dict(share, id=self.new_id())
+        self.shares[share['id']] = share
+        return share
+
+    ########### HELPERS ###########
+    @staticmethod
+    def normalize(path):
+        return path.rstrip('/') or '/'
+
+    def display_path(self, file_id):
+        path = self.ids[file_id]
+        return path if path == '/' else path + '/'
+
+    def lookup(self, ref):
+        ref = unquote(ref)
+        if ref.startswith('/'):
+            path = self.normalize(ref)
+            if path not in self.paths:
+                raise not_found(path)
+            return self.paths[path]
+        if ref not in self.ids:
+            raise not_found(ref)
+        return ref
+
+    ########### AUTH ###########
+    def login(self, request):
+        body = request.body or {}
+        if body.get('username') != 'admin' or body.get('password') != 'Admin123':
+            raise MockError(401, 'authentication_failed', 'Invalid username or password')
+        return {'bearer_token': 'mock-token'}
+
+    ########### FILES AND QUOTAS ###########
+    def get_file_attr(self, request):
+        file_id = self.lookup(request.match['ref'])
+        path = self.ids[file_id]
+        return {'id': file_id, 'file_number': file_id, 'path': self.display_path(file_id),
+            'name': path.rsplit('/', 1)[-1], 'type': 'FS_FILE_TYPE_DIRECTORY'}
+
+    def create_entry(self, request):
+        parent_id = self.lookup(request.match['ref'])
+        parent = self.ids[parent_id]
+        path = self.normalize(parent.rstrip('/') + '/' + request.body['name'])
+        if path in self.paths:
+            raise MockError(409, 'fs_entry_exists_error', f'{path} already exists')
+        self.make_directory(path)
+        return self.get_file_attr_by_id(self.paths[path])
+
+    def get_file_attr_by_id(self, file_id):
+        return {'id': file_id, 'file_number': file_id, 'path': self.display_path(file_id),
+            'type': 'FS_FILE_TYPE_DIRECTORY'}
+
+    def resolve_paths(self, request):
+        return [{'id': file_id, 'path': self.display_path(file_id) if file_id in self.ids else ''}
+            for file_id in request.body]
+
+    def quota_status(self, file_id):
+        return {'id': file_id, 'path': self.display_path(file_id), 'limit': self.quotas[file_id],
+            'capacity_usage': str(int(self.quotas[file_id]) // 3)}
+
+    def list_quotas(self, request):
+        limit = int(request.query.get('limit', ['1000'])[0])
+        after = int(request.query.get('after', ['0'])[0])
+        ids = sorted(self.quotas, key=int)
+        page = [self.quota_status(file_id) for file_id in ids[after:after + limit]]
+        next_uri = ''
+        if after + limit < len(ids):
+            next_uri = f'/v1/files/quotas/status/?after={after + limit}&limit={limit}'
+        return {'quotas': page, 'paging': {'next': next_uri}}
+
+    def get_quota(self, request):
+        if request.match['id_'] not in self.quotas:
+            raise not_found('quota')
+        return {'id': request.match['id_'], 'limit': self.quotas[request.match['id_']]}
+
+    def get_quota_status(self, request):
+        if request.match['id_'] not in self.quotas:
+            raise not_found('quota')
+        return self.quota_status(request.match['id_'])
+
+    def create_quota(self, request):
+        file_id = str(request.body['id'])
+        if file_id not in self.ids:
+            raise not_found(file_id)
+        if file_id in self.quotas:
+            raise MockError(409, 'quota_exists_error', f'{file_id} already has a quota')
+        self.quotas[file_id] = str(request.body['limit'])
+        return {'id': file_id, 'limit': self.quotas[file_id]}
+
+    def update_quota(self, request):
+        if request.match['id_'] not in self.quotas:
+            raise not_found('quota')
+        self.quotas[request.match['id_']] = str(request.body['limit'])
+        return {'id': request.match['id_'], 'limit': self.quotas[request.match['id_']]}
+
+    ########### USERS ###########
+    def list_users(self, request):
+        return list(self.users.values())
+
+    def add_user(self, request):
+        body = request.body
+        if any(user['name'] == body['name'] for user in self.users.values()):
+            raise MockError(409, 'user_exists_error', f'{body["name"]} already exists')
+        user_id = self.new_id()
+        self.users[user_id] = self.user_record(user_id, body['name'], body.get('uid') or '',
+            body['primary_group'], body.get('home_directory'))
+        return self.users[user_id]
+
+    def modify_user(self, request):
+        if request.match['id_'] not in self.users:
+            raise not_found('user')
+        body = request.body
+        self.users[request.match['id_']].update({'name': body['name'], 'uid': body['uid'],
+            'primary_group': body['primary_group'], 'home_directory': body['home_directory']})
+        return self.users[request.match['id_']]
+
+    ########### NFS ###########
+    def list_exports(self, request):
+        return {'entries': list(self.exports.values())}
+
+    def add_export(self, request):
+        export = dict(request.body)
+        export.setdefault('tenant_id', 1)
+        export.setdefault('fields_to_present_as_32_bit', [])
+        if self.normalize(export['fs_path']) not in self.paths:
+            if request.query.get('allow-fs-path-create') != ['true']:
+                raise not_found(export['fs_path'])
+            self.make_directory(self.normalize(export['fs_path']))
+        return self.add_export_record(export)
+
+    def modify_export(self, request):
+        if request.match['id_'] not in self.exports:
+            raise not_found('export')
+        self.exports[request.match['id_']].update(request.body)
+        return self.exports[request.match['id_']]
+
+    ########### SMB ###########
+    def list_shares(self, request):
+        return {'entries': list(self.shares.values())}
+
+    def get_share(self, request):
+        if request.match['id_'] not in self.shares:
+            raise not_found('share')
+        return self.shares[request.match['id_']]
+
+    def add_share(self, request):
+        share = dict(request.body)
+        share.setdefault('tenant_id', 1)
+        if self.normalize(share['fs_path']) not in self.paths:
+            if request.query.get('allow-fs-path-create') != ['true']:
+                raise not_found(share['fs_path'])
+            self.make_directory(self.normalize(share['fs_path']))
+        return self.add_share_record(share)
+
+    def modify_share(self, request):
+        if request.match['id_'] not in self.shares:
+            raise not_found('share')
+        self.shares[request.match['id_']].update(request.body)
+        return self.shares[request.match['id_']]
+
+    ########### TENANTS, NODES AND NETWORK ###########
+    def list_tenants(self, request):
+        return {'entries': self.tenants}
+
+    def list_nodes(self, request):
+        return self.nodes
+
+    def node_address(self, node):
+        return f'127.0.0.{node["id"]}' if self.all_nodes else '127.0.0.1'
+
+    def network_status(self, request):
+        return [{'node_id': node['id'], 'node_name': node['node_name'],
+            'network_statuses': [{'address': self.node_address(node), 'floating_addresses': []}]}
+            for node in self.nodes]
+
+    def modify_interface(self, request):
+        self.interfaces[0].update(request.body)
+        return self.interfaces[0]
+
+    def add_network(self, request):
+        network = dict(request.body, id=len(self.networks) + 1)
+        self.networks.append(network)
+        return network
+
+    def modify_network(self, request):
+        for network in self.networks:
+            if str(network['id']) == request.match['network_id']:
+                network.update(request.body)
+                return network
+        raise not_found('network')
+
+    ########### OTHER SETTINGS ###########
+    def set_time(self, request):
+        self.time_settings.update(request.body)
+        return self.time_settings
+
+    def set_ldap(self, request):
+        self.ldap_settings.update(request.body)
+        return self.ldap_settings
+
+    def join_ad(self, request):
+        self.ad_status.update({'status': 'JOINED_TO_DOMAIN', 'domain': request.body.get('domain', '')})
+        return {'monitor_uri': '/v1/ad/monitor'}
+
+    def list_policies(self, request):
+        return {'entries': list(self.policies.values())}
+
+    def create_policy(self, request):
+        policy = dict(request.body, id=self.new_id())
+        policy['schedule'] = dict(policy['schedule'], id=1)
+        self.policies[policy['id']] = policy
+        return policy
+
+    def create_replication(self, request):
+        relationship = dict(request.body, id=self.new_id())
+        self.replications.append(relationship)
+        return relationship
+
+    ########### DISPATCH ###########
+    def dispatch(self, request):
+        '''Return (status, body, endpoint name) for a parsed request'''
+        for method, pattern, handler in self.routes:
+            if method != request.method:
+                continue
+            match = pattern.match(request.path)
+            if match is None:
+                continue
+            request.match = match.groupdict()
+            name = f'{method} {pattern.pattern[:-1]}'
+            try:
+                with self.lock:
+                    return 200, handler(request), name
+            except MockError as excpt:
+                return excpt.status, {'error_class': excpt.error_class,
+                    'description': excpt.description, 'module': 'mock_cluster'}, name
+        return 404, {'error_class': 'http_not_found_error',
+            'description': f'{request.method} {request.path} is not implemented'}, 'unmatched'
+
+    def reset_stats(self):
+        with self.stats_lock:
+            self.stats = {'requests': 0, 'bytes_sent': 0, 'endpoints': {}, 'nodes': {}}
+
+    def record(self, name, status, size, address):
+        with self.stats_lock:
+            self.stats['requests'] += 1
+            self.stats['nodes'][address] = self.stats['nodes'].get(address, 0) + 1
+            self.stats['bytes_sent'] += size
+            endpoint = self.stats['endpoints'].setdefault(name, {'count': 0, 'errors': 0})
+            endpoint['count'] += 1
+            if status >= 400:
+                endpoint['errors'] += 1
+
+class MockRequest:
+    def __init__(self, method, target, body):
+        parts = urlsplit(target)
+        self.method = method
+        self.path = parts.path
+        self.query = parse_qs(parts.query)
+        self.body = body
+        self.match = {}
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body are written separately; without TCP_NODELAY every
+    # response would wait for a delayed ACK.
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        logging.debug(format % args)
+
+    def handle_any(self):
+        cluster = self.server.cluster
+        length = int(self.headers.get('Content-Length') or 0)
+        body = json.loads(self.rfile.read(length)) if length else None
+
+        if self.path.startswith('/_mock/'):
+            status, data = self.handle_control(cluster, body)
+        else:
+            if cluster.latency:
+                time.sleep(cluster.latency)
+            if cluster.error_rate and random.random() < cluster.error_rate:
+                status, data, name = 503, {'error_class': 'service_unavailable_error',
+                    'description': 'Injected by mock_cluster.py', 'module': 'mock_cluster'}, 'injected errors'
+            else:
+                status, data, name = cluster.dispatch(MockRequest(self.command, self.path, body))
+
+        payload = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+        if not self.path.startswith('/_mock/'):
+            cluster.record(name, status, len(payload), self.server.server_address[0])
+
+    def handle_control(self, cluster, body):
+        # Control endpoints for the benchmark harness; they are not counted.
+        if self.command == 'GET' and self.path == '/_mock/stats':
+            with cluster.stats_lock:
+                return 200, json.loads(json.dumps(cluster.stats))
+        if self.command == 'POST' and self.path == '/_mock/stats/reset':
+            cluster.reset_stats()
+            return 200, {}
+        if self.command == 'POST' and self.path == '/_mock/reset':
+            cluster.generate(**(body or {}))
+            return 200, {}
+        if self.command == 'POST' and self.path == '/_mock/latency':
+            cluster.latency = float(body['latency_ms']) / 1000.0
+            return 200, {}
+        if self.command == 'POST' and self.path == '/_mock/faults':
+            cluster.error_rate = float(body['error_rate'])
+            return 200, {}
+        return 404, {'description': f'{self.command} {self.path} is not a mock control endpoint'}
+
+    do_GET = do_POST = do_PUT = do_PATCH = do_DELETE = handle_any
+
+def make_certificate(directory):
+    '''Create a throwaway self-signed certificate with the openssl command'''
+    cert_file = os.path.join(directory, 'mock_cluster.crt')
+    key_file = os.path.join(directory, 'mock_cluster.key')
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1',
+        '-subj', '/CN=mock-cluster', '-keyout', key_file, '-out', cert_file],
+        check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return cert_file, key_file
+
+def serve(cluster, port=0, address='127.0.0.1'):
+    '''Return an HTTPS server for cluster; call serve_forever() to run it'''
+    # The Qumulo client always speaks HTTPS and doesn't verify certificates.
+    cert_file, key_file = make_certificate(tempfile.mkdtemp(prefix='mock_cluster_'))
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert_file, key_file)
+
+    cluster.reset_stats()
+    server = ThreadingHTTPServer((address, port), MockHandler)
+    server.daemon_threads = True
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+    server.cluster = cluster
+    return server
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -9,7 +9,7 @@ import qumulo.rest
 import time
 import sys, getopt
 from getpass import getpass
-import jmespath
+from common import TenantMap, write_plan, read_plan, enable_profiling, instrument, Journal, DumpScope, DUMP_FORMATS, DumpWriter, load_records, stream
 
 def main(argv):
     # Logging Details
@@ -23,20 +23,36 @@ def main(argv):
 
     # Argument Parameters Details 
     err_msg = '''
-usage: qumulo_sync.py [-a|--auto_approve] [-d|--dump] [-s|--set] 
+usage: nfs_exports.py [-a|--auto_approve] [--format FORMAT] [-d|--dump] [-s|--set] [--sync] [--plan FILE] [--apply FILE] [--profile] [--resume] [--only PATTERN] [--tenant NAME] [--path PREFIX] [--name PATTERN]
 
-Dump or Set SMB settings and shares. 
+Dump or Set NFS exports. 
 
 optional arguments:
 -h, --help          Show this help message and exit
 -a, --auto_approve  Sync all existing settings without confirmation. If you want to use it, please put it before other arguments.
--d, --dump          Dump SMB settings and shares.
--s, --set           Sent SMB settings and shares.
+--format FORMAT     Dump file format: json (default), jsonl, jsonl.gz or jsonl.zst. The jsonl formats hold one export per line, gzip or zstd compressed for the last two (zstd needs the zstandard package). Use the same format for --dump and --set. If you want to use it, please put it before other arguments.
+-d, --dump          Dump NFS exports.
+-s, --set           Set NFS exports.
+--sync              Set the NFS exports of the primary cluster on the secondary cluster directly, without dump files. The secondary is set while the primary is still being read. Confirmations and --resume work as for --set.
+--plan FILE         Write the changes --set would make into a plan file, without changing anything.
+--apply FILE        Apply a plan file written by --plan without confirmation.
+--profile           Print per-endpoint API call counts and latencies at exit and write them into nfs_exports_profile.json. If you want to use it, please put it before other arguments.
+--resume            Skip what an interrupted -s or --apply run against the same cluster already completed, as recorded in nfs_journal.jsonl. If you want to use it, please put it before -s or --apply.
+--only PATTERN      Only set the exports whose export path that start with PATTERN, or match it when it contains *, ? or [. Can be given more than once. If you want to use it, please put it before -s or --plan.
+--tenant NAME       Only dump or sync the exports of this tenant. Can be given more than once. If you want to use it, please put it before -d or --sync.
+--path PREFIX       Only dump or sync the exports whose file system path is PREFIX or below it. Can be given more than once. If you want to use it, please put it before -d or --sync.
+--name PATTERN      Only dump or sync the exports whose export path starts with PATTERN, or matches it when it contains *, ? or [. Can be given more than once. If you want to use it, please put it before -d or --sync.
     '''
     try:
         if len(sys.argv) > 1:
-            opts, args = getopt.getopt(argv,'hads :',["help","auto_approve","dump","set"])
+            opts, args = getopt.getopt(argv,'hads :',["help","auto_approve","format=","dump","set","sync","plan=","apply=","profile","resume","only=","tenant=","path=","name="])
             approve = False
+            resume = False
+            only = []
+            scope_tenants = []
+            scope_paths = []
+            scope_names = []
+            dump_format = 'json'
         else:
             print(err_msg)
             sys.exit(2)
@@ -52,14 +68,44 @@ optional arguments:
         elif opt in ("-d","--dump"):
             prc = login('primary')
             print ()
-            nfs_list(prc)
+            nfs_list(prc, dump_format=dump_format, scope=DumpScope(scope_tenants, scope_paths, scope_names))
         elif opt in ("-a","--auto_approve"):
             approve = True
+        elif opt == "--plan":
+            src = login('secondary')
+            print ()
+            write_plan(arg, 'nfs', src, nfs_plan(src, dump_format=dump_format, only=only))
+        elif opt == "--sync":
+            prc = login('primary')
+            src = login('secondary')
+            print ()
+            nfs_sync(prc, src, approve, Journal('nfs', src, resume), scope=DumpScope(scope_tenants, scope_paths, scope_names))
+        elif opt == "--format":
+            if arg not in DUMP_FORMATS:
+                print (err_msg)
+                sys.exit(2)
+            dump_format = arg
+        elif opt == "--tenant":
+            scope_tenants.append(arg)
+        elif opt == "--path":
+            scope_paths.append(arg)
+        elif opt == "--name":
+            scope_names.append(arg)
+        elif opt == "--only":
+            only.append(arg)
+        elif opt == "--resume":
+            resume = True
+        elif opt == "--profile":
+            enable_profiling('nfs_exports_profile.json')
+        elif opt == "--apply":
+            src = login('secondary')
+            print ()
+            nfs_apply(src, read_plan(arg, 'nfs', src), True, Journal('nfs', src, resume))
         else:            
             if opt in ("-s","--set"):
                 src = login('secondary')
                 print ()
-                nfs_define(src, approve)
+                nfs_define(src, approve, journal=Journal('nfs', src, resume), dump_format=dump_format, only=only)
 
 def login(cluster):
     # Cluster address is one of the IP addresses of the cluster nodes that is required for the API connectivity
@@ -72,6 +118,7 @@ def login(cluster):
     port = ""
     username = ""
     password = ""
+    node_balancing = None
 
     if path.exists('credentials.json') == True:
         json_file = open('credentials.json','r')
@@ -94,6 +141,8 @@ def login(cluster):
         if password == "":
             password = getpass(cluster.capitalize() +  " Password: ")
 
+        node_balancing = json_object[cluster].get('node_balancing')
+
     else:
         print()
         cluster_address = input(cluster.capitalize() + " Cluster address: ")
@@ -108,75 +157,117 @@ def login(cluster):
         rc.login(username, password)
         logging.info(f'Connection established with {cluster_address}')
 
-        return (rc)
+        return instrument(rc, node_balancing)
 
     except Exception as excpt:
         logging.error(f'Connection issue with {cluster_address}')
         logging.error(f'Error: {excpt}')
         sys.exit(1)
 
-def get_tenant_name(rc, tenant_id):
-    tenants = rc.multitenancy.list_tenants()
-    for tenant in tenants:
-        if tenant_id == tenant.id:
-            return tenant.name
+def nfs_key(export):
+    return export['export_path']
 
-def get_tenant_id(rc, tenant_name):
-    tenants = rc.multitenancy.list_tenants()
-    for tenant in tenants:
-        if tenant_name == tenant.name:
-            return tenant.id  
-
-def nfs_list(rc):
+def nfs_records(rc, tenants=None, scope=None):
+    '''Yield the dump record of every export on the cluster of rc'''
+    if tenants is None:
+        tenants = TenantMap(rc)
     exports = rc.nfs.nfs_list_exports()['entries']
-    nfs_exports = []
-    count = 0
     for export in exports:
+        if scope is not None and not scope.includes(tenants.name(export['tenant_id']), export['fs_path'], export['export_path']):
+            continue
         export_details = {}
         export_details = {
             "export_path" : export['export_path'],
-            "tenant_name" : get_tenant_name(rc, export['tenant_id']),
+            "tenant_name" : tenants.name(export['tenant_id']),
             "fs_path" : export['fs_path'],
             "description" : export['description'],
             "restrictions" : export['restrictions'],
             "allow_fs_path_create" : True,
             "fields_to_present_as_32_bit" : export['fields_to_present_as_32_bit']
             }
-        nfs_exports.append(export_details)
-        logging.info(f'{export["export_path"]} configurations was listed')
-        count +=1
-    logging.info(f'Totally {count} NFS exports were added into the JSON file')
-    nfs_json_file = open('nfs.json', 'w')
-    json.dump(nfs_exports, nfs_json_file, indent=4)
-    nfs_json_file.close()
-
-def nfs_define(rc, approve):
-    approve = False
-    nfs_json_file = open('nfs.json','r')
-    nfs_json_data = nfs_json_file.read()
-    nfs_json_object = json.loads(nfs_json_data)
-    
-    nfs_exports = nfs_json_object
-    count = 0
+        yield export_details
+
+def nfs_list(rc, tenants=None, dump_format='json', scope=None):
+    nfs_writer = DumpWriter('nfs', dump_format, key=nfs_key)
+    for export_details in nfs_records(rc, tenants, scope):
+        nfs_writer.write(export_details)
+        logging.info(f'{export_details["export_path"]} configurations was listed')
+    nfs_writer.close()
+    logging.info(f'Totally {nfs_writer.count} NFS exports were added into {nfs_writer.file_name}')
+
+def nfs_index(rc):
+    # The destination exports are listed once and indexed by
+    # (tenant_id, export_path), since export paths are only unique per tenant.
+    exports = {}
+    for export in rc.nfs.nfs_list_exports()['entries']:
+        exports[(export['tenant_id'], export['export_path'])] = export
+    return exports
+
+def nfs_export_changed(existing_export, export):
+    return (
+        existing_export['fs_path'] != export['fs_path'] or
+        existing_export['description'] != export['description'] or
+        existing_export['restrictions'] != export['restrictions'] or
+        (existing_export['fields_to_present_as_32_bit'] or []) != (export['fields_to_present_as_32_bit'] or [])
+        )
+
+def nfs_plan(rc, tenants=None, dump_format='json', only=None):
+    '''Return the create/update/skip action for every export in the dump'''
+    return list(nfs_actions(rc, load_records('nfs', dump_format, only, nfs_key), tenants))
+
+def nfs_actions(rc, nfs_exports, tenants=None):
+    '''Yield the create/update/skip action for every export record, against the cluster of rc'''
+    if tenants is None:
+        tenants = TenantMap(rc)
+    existing_exports = nfs_index(rc)
     for export in nfs_exports:
         export_path = export['export_path']
-        fs_path = export['fs_path']
-        description = export['description']
-        tenant_id = get_tenant_id(rc, export['tenant_name'])
-        restrictions = []
-        for r in export['restrictions']:
-            restrictions.append(qumulo.rest.nfs.NFSExportRestriction(r))
+        tenant_id = tenants.id(export['tenant_name'])
         fields_to_present_as_32_bit = export['fields_to_present_as_32_bit']
         if (fields_to_present_as_32_bit == []):
             fields_to_present_as_32_bit = None
+        action = {
+            "action" : "create",
+            "export_path" : export_path,
+            "fs_path" : export['fs_path'],
+            "description" : export['description'],
+            "restrictions" : export['restrictions'],
+            "tenant_id" : tenant_id,
+            "fields_to_present_as_32_bit" : fields_to_present_as_32_bit
+            }
 
-        nfs_exports = rc.nfs.nfs_list_exports()['entries']
-        existing_export = jmespath.search(
-            f"[?export_path == '{export_path}']", nfs_exports
-        )
-        if existing_export != []: 
-            export_id = existing_export[0]["id"]
-            logging.error(f'{export_path} NFS export is already defined.')
+        existing_export = existing_exports.get((tenant_id, export_path))
+        if existing_export is not None: 
+            action['export_id'] = existing_export["id"]
+            if nfs_export_changed(existing_export, export):
+                action['action'] = 'update'
+            else:
+                action['action'] = 'skip'
+                action['reason'] = 'unchanged'
+        yield action
+
+def nfs_apply(rc, actions, approve, journal=None):
+    count = 0
+    unchanged = 0
+    for action in actions:
+        export_path = action['export_path']
+        fs_path = action['fs_path']
+        restrictions = []
+        for r in action['restrictions']:
+            restrictions.append(qumulo.rest.nfs.NFSExportRestriction(r))
+
+        key = f'{action["tenant_id"]}:{export_path}'
+        if journal is not None and journal.done(key):
+            logging.debug(f'{export_path} NFS export was set by an earlier run.')
+            continue
+
+        if action['action'] == 'skip':
+            unchanged += 1
+            logging.debug(f'{export_path} NFS export is already up to date.')
+            continue
+
+        if action['action'] == 'update':
+            logging.info(f'{export_path} NFS export is already defined.')
 
             if approve == False:
                 update_confirm = input("Do you want to update "+ export_path +" NFS export?: [Y/n]")
@@ -186,16 +277,18 @@ def nfs_define(rc, approve):
 
             if update_confirm in ["y","Y","Yes","yes"]:
                 rc.nfs.nfs_modify_export(
-                    id_ = export_id,
+                    export_id = action['export_id'],
                     export_path = export_path,
                     fs_path = fs_path,
-                    description = description,
+                    description = action['description'],
                     restrictions = restrictions, 
-                    tenant_id = tenant_id,
+                    tenant_id = action['tenant_id'],
                     allow_fs_path_create=False, 
-                    fields_to_present_as_32_bit=fields_to_present_as_32_bit
+                    fields_to_present_as_32_bit=action['fields_to_present_as_32_bit']
                     )
                 logging.info(f'{export_path} export configuration was updated.')
+                if journal is not None:
+                    journal.record(key)
             else:
                 print(export_path + " export wasn't updated...")
                 logging.info(f'{export_path} export wasn\'t updated.')
@@ -211,15 +304,27 @@ def nfs_define(rc, approve):
                 rc.nfs.nfs_add_export(
                     export_path = export_path,
                     fs_path = fs_path,
-                    description = description,
+                    description = action['description'],
                     restrictions= restrictions, 
-                    tenant_id = tenant_id,
+                    tenant_id = action['tenant_id'],
                     allow_fs_path_create=True, 
-                    fields_to_present_as_32_bit=fields_to_present_as_32_bit
+                    fields_to_present_as_32_bit=action['fields_to_present_as_32_bit']
                     )
                 logging.info(f"A new NFS export was created for path: {fs_path} with export path: {export_path}")
+                if journal is not None:
+                    journal.record(key)
         count +=1
-    logging.info(f'Totally {count} NFS exports were added into the JSON file')
+    logging.info(f'{unchanged} NFS exports were already up to date and skipped')
+    logging.info(f'Totally {count} NFS exports were processed')
+
+def nfs_define(rc, approve, tenants=None, journal=None, dump_format='json', only=None):
+    nfs_apply(rc, nfs_plan(rc, tenants, dump_format, only), approve, journal)
+
+def nfs_sync(prc, src, approve, journal=None, scope=None):
+    # No dump file: the primary's exports are listed and turned into dump
+    # records by a thread of their own and handed over through a bounded
+    # queue, so the secondary is set while the primary is still being read.
+    nfs_apply(src, nfs_actions(src, stream(nfs_records(prc, scope=scope))), approve, journal)
 
 if __name__ == '__main__':
     main(sys.argv[1:])
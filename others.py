@@ -9,6 +9,7 @@ import qumulo.rest
 import time
 import sys, getopt
 from getpass import getpass
+from common import TenantMap, PathCache, PathResolver, run_parallel, write_plan, read_plan, enable_profiling, instrument, Journal
 
 def main(argv):
     # Logging Details
@@ -22,20 +23,25 @@ def main(argv):
 
     # Argument Parameters Details 
     err_msg = '''
-usage: qumulo_sync.py [-a|--auto_approve] [-d|--dump] [-s|--set] 
+usage: others.py [-a|--auto_approve] [-d|--dump] [-s|--set] [--plan FILE] [--apply FILE] [--profile] [--resume]
 
-Dump or Set SMB settings and shares. 
+Dump or Set Network, NTP, LDAP, AD, replication and snapshot policy settings. 
 
 optional arguments:
 -h, --help          Show this help message and exit
 -a, --auto_approve  Sync all existing settings without confirmation. If you want to use it, please put it before other arguments.
--d, --dump          Dump SMB settings and shares.
--s, --set           Sent SMB settings and shares.
+-d, --dump          Dump the settings.
+-s, --set           Set the settings.
+--plan FILE         Write the changes --set would make into a plan file, without changing anything.
+--apply FILE        Apply a plan file written by --plan. LDAP and AD bind credentials are still asked for.
+--profile           Print per-endpoint API call counts and latencies at exit and write them into others_profile.json. If you want to use it, please put it before other arguments.
+--resume            Skip what an interrupted -s or --apply run against the same cluster already completed, as recorded in others_journal.jsonl. If you want to use it, please put it before -s or --apply.
     '''
     try:
         if len(sys.argv) > 1:
-            opts, args = getopt.getopt(argv,'hads :',["help","auto_approve","dump","set"])
+            opts, args = getopt.getopt(argv,'hads :',["help","auto_approve","dump","set","plan=","apply=","profile","resume"])
             approve = False
+            resume = False
         else:
             print(err_msg)
             sys.exit(2)
@@ -54,11 +60,23 @@ optional arguments:
             others_list(prc)
         elif opt in ("-a","--auto_approve"):
             approve = True
+        elif opt == "--plan":
+            src = login('secondary')
+            print ()
+            write_plan(arg, 'others', src, others_plan(src))
+        elif opt == "--resume":
+            resume = True
+        elif opt == "--profile":
+            enable_profiling('others_profile.json')
+        elif opt == "--apply":
+            src = login('secondary')
+            print ()
+            others_apply(src, read_plan(arg, 'others', src), Journal('others', src, resume))
         else:            
             if opt in ("-s","--set"):
                 src = login('secondary')
                 print ()
-                others_define(src, approve)
+                others_define(src, approve, journal=Journal('others', src, resume))
 
 def login(cluster):
     # Cluster address is one of the IP addresses of the cluster nodes that is required for the API connectivity
@@ -71,6 +89,7 @@ def login(cluster):
     port = ""
     username = ""
     password = ""
+    node_balancing = None
     top_dir = ""
 
 
@@ -96,6 +115,8 @@ def login(cluster):
         if password == "":
             password = getpass(cluster.capitalize() +  " Password: ")
 
+        node_balancing = json_object[cluster].get('node_balancing')
+
 
                 
 
@@ -115,253 +136,392 @@ def login(cluster):
         print ("Connection established with " + cluster_address)
         logging.info(f'Connection established with {cluster_address}')
 
-        return (rc)
+        return instrument(rc, node_balancing)
 
     except Exception as excpt:
         logging.error(f'Connection issue with {cluster_address}')
         logging.error(f'Error: {excpt}')
         sys.exit(1)
         
-def get_tenant_name(rc, tenant_id):
-    tenants = rc.multitenancy.list_tenants()
-    for tenant in tenants:
-        if tenant_id == tenant.id:
-            return tenant.name
-
-def get_tenant_id(rc, tenant_name):
-    tenants = rc.multitenancy.list_tenants()
-    for tenant in tenants:
-        if tenant_name == tenant.name:
-            return tenant.id  
-
-def others_list(rc):
-    ########### NTP ###########
-    ntp=rc.time_config.get_time()
-    ntp_json_file = open('ntp.json', 'w')
-    json.dump(ntp, ntp_json_file, indent=4)
-    ntp_json_file.close()
+def others_list(rc, tenants=None):
+    # The sections don't depend on each other, so they are fetched at the same
+    # time on their own connections. Each JSON file is written as soon as its
+    # section is fetched, and a failing section doesn't stop the others.
+    if tenants is None:
+        tenants = TenantMap(rc)
+    sections = [
+        ('NTP', ntp_list),
+        ('replication', replication_list),
+        ('LDAP', ldap_list),
+        ('user mapping', maps_list),
+        ('AD', ad_list),
+        ('snapshot policy', snapshot_policy_list),
+        ('network', lambda rc: network_list(rc, tenants)),
+    ]
+    failed = []
+    results = run_parallel(rc, lambda rc, section: section[1](rc), sections, len(sections))
+    for (name, func), (result, error) in zip(sections, results):
+        if error is not None:
+            logging.error(f'The {name} configurations could not be dumped')
+            logging.error(f'Error: {error}')
+            failed.append(name)
+    return failed
+
+def dump_json(file_name, data):
+    json_file = open(file_name, 'w')
+    json.dump(data, json_file, indent=4)
+    json_file.close()
+
+########### NTP ###########
+def ntp_list(rc):
+    dump_json('ntp.json', rc.time_config.get_time())
     logging.info(f'The NTP configurations were added into the JSON file')
 
-    ########### REPLICATION ###########
-    replications = rc.replication.list_source_relationship_statuses()
-    replication_json_file = open('replication.json', 'w')
-    json.dump(replications, replication_json_file, indent=4)
-    replication_json_file.close()
+########### REPLICATION ###########
+def replication_list(rc):
+    dump_json('replication.json', rc.replication.list_source_relationship_statuses())
     logging.info(f'The replication configurations were added into the JSON file')
-    
-    ########### LDAP ########### 
-    ldap=rc.ldap.settings_get_v2()
-    ldap_json_file = open('ldap.json', 'w')
-    json.dump(ldap, ldap_json_file, indent=4)
-    ldap_json_file.close()
+
+########### LDAP ###########
+def ldap_list(rc):
+    dump_json('ldap.json', rc.ldap.settings_get_v2())
     logging.info(f'The LDAP configurations were added into the JSON file')
 
-    ########### USER MAPPINGS ########### 
-    maps=rc.auth.user_defined_mappings_get()
-    maps_json_file = open('maps.json', 'w')
-    json.dump(maps, maps_json_file, indent=4)
-    maps_json_file.close()
+########### USER MAPPINGS ###########
+def maps_list(rc):
+    dump_json('maps.json', rc.auth.user_defined_mappings_get())
     logging.info(f'The user mappings were added into the JSON file')
 
-    ########### AD ########### 
-    ad=rc.ad.poll_ad()
-    ad_json_file = open('ad.json', 'w')
-    json.dump(ad, ad_json_file, indent=4)
-    ad_json_file.close()
+########### AD ###########
+def ad_list(rc):
+    dump_json('ad.json', rc.ad.poll_ad())
     logging.info(f'The AD configurations were added into the JSON file')
-    
-    ########### TENANTS ########### 
-    # ad=rc.ad.poll_ad()
-    # ad_json_file = open('ad.json', 'w')
-    # json.dump(ad, ad_json_file, indent=4)
-    # ad_json_file.close()
-    # logging.info(f'The multi-tenancy configurations were added into the JSON file')
 
-    ########### SNAPSHOT POLICIES ########### 
+########### TENANTS ###########
+# ad=rc.ad.poll_ad()
+# ad_json_file = open('ad.json', 'w')
+# json.dump(ad, ad_json_file, indent=4)
+# ad_json_file.close()
+# logging.info(f'The multi-tenancy configurations were added into the JSON file')
+
+########### SNAPSHOT POLICIES ###########
+def snapshot_policy_list(rc):
     snapshot_policies = rc.snapshot.list_policies()['entries']
+    directory_paths = PathResolver(rc).paths([policy['source_file_id'] for policy in snapshot_policies])
     snap_policies = []
     for policy in snapshot_policies:
-        directory_id = policy['source_file_id']
-        policy['directory_path'] = rc.fs.resolve_paths(ids=[directory_id])[0]['path']
+        policy['directory_path'] = directory_paths[policy['source_file_id']]
         snap_policies.append(policy)
-    snap_policy_json_file = open('snap_policy.json', 'w')
-    json.dump(snap_policies, snap_policy_json_file, indent=4)
-    snap_policy_json_file.close()
+    dump_json('snap_policy.json', snap_policies)
     logging.info(f'The snapshot policy configurations were added into the JSON file')
 
-    ########### NETWORK ########### 
+########### NETWORK ###########
+def network_list(rc, tenants):
     interface = rc.network.list_interfaces()
     networks = rc.network.list_networks(1)
     networks_w_tn = []
     for network in networks:
-        network['tenant_name'] = get_tenant_name(rc, network['tenant_id'])
+        network['tenant_name'] = tenants.name(network['tenant_id'])
         networks_w_tn.append(network)
     network_settings = {
         'interface' : interface,
         'networks' : networks_w_tn
     }
-    network_json_file = open('network.json', 'w')
-    json.dump(network_settings, network_json_file, indent=4)
-    network_json_file.close()
+    dump_json('network.json', network_settings)
     logging.info(f'The network configurations were added into the JSON file')
 
-def others_define(rc, approve):
-    approve = False
+# Fields of the dumped settings that others_apply sets; a destination whose
+# fields all match the dump is skipped
+NTP_FIELDS = ('use_ad_for_primary', 'ntp_servers')
+INTERFACE_FIELDS = ('default_gateway', 'bonding_mode', 'mtu')
+NETWORK_FIELDS = ('assigned_by', 'floating_ip_ranges', 'dns_servers', 'dns_search_domains', 'ip_ranges', 'netmask', 'tenant_id', 'vlan_id')
+LDAP_FIELDS = ('use_ldap', 'bind_uri', 'base_distinguished_names', 'ldap_schema', 'encrypt_connection')
+
+def settings_match(existing, action, fields):
+    return existing is not None and all(existing.get(field) == action[field] for field in fields)
+
+def skip_if(action, unchanged, reason='unchanged'):
+    if unchanged:
+        action['action'] = 'skip'
+        action['reason'] = reason
+    return action
+
+def others_plan(rc, tenants=None):
+    '''Return the create/update/skip actions that set the dumped NTP, replication, network, LDAP, AD and snapshot policy settings'''
+    if tenants is None:
+        tenants = TenantMap(rc)
+    actions = []
 
     ########### NTP ########### 
     ntp_json_file = open('ntp.json','r')
     ntp_json_data = ntp_json_file.read()
-    ntp_json_object = json.loads(ntp_json_data)
-    
-    try:
-        ntp = ntp_json_object
-        rc.time_config.set_time(
-            use_ad_for_primary=ntp['use_ad_for_primary'], 
-            ntp_servers=ntp['ntp_servers'])
-        logging.info(f'The NTP configurations are done.')
-    except Exception as excpt:
-        logging.error(f'Error: {excpt}')
+    ntp = json.loads(ntp_json_data)
+    action = {
+        "action" : "update",
+        "section" : "ntp",
+        "use_ad_for_primary" : ntp['use_ad_for_primary'],
+        "ntp_servers" : ntp['ntp_servers']
+        }
+    actions.append(skip_if(action, settings_match(rc.time_config.get_time(), action, NTP_FIELDS)))
 
     ########### REPLICATION ###########
     replication_json_file = open('replication.json', 'r')
     replication_json_data = replication_json_file.read()
     replications = json.loads(replication_json_data)
-    top_dir = input(cluster.capitalize() +  " top directory path for replications: ")
+    # A relationship from the same source path to the same target address
+    # is already there
+    existing_replications = set()
+    if replications != []:
+        for existing_replication in rc.replication.list_source_relationship_statuses():
+            existing_replications.add((existing_replication['source_root_path'], existing_replication['target_address']))
+    if any((replication['source_root_path'], replication['target_address']) not in existing_replications for replication in replications):
+        top_dir = input("Secondary top directory path for replications: ")
     for replication in replications:
-        source_path = replication['source_root_path']
-        target_path = f"{top_dir}{replication['target_root_path']}"
-        address = replication['target_address']
-        port = replication['target_port']
-        map_nfs = replication['map_local_ids_to_nfs_ids']
-        rep_mode = replication['replication_mode']
-        snapshot_policies = replication['snapshot_policies']
-        rc.replication.create_source_relationship(target_path=target_path, address=address, source_path=source_path, map_local_ids_to_nfs_ids= map_nfs, 
-            target_port=port, replication_mode=rep_mode, snapshot_policies=snapshot_policies)
-
-
-    logging.info(f'The replication configurations were added into the JSON file')
+        if (replication['source_root_path'], replication['target_address']) not in existing_replications:
+            actions.append({
+                "action" : "create",
+                "section" : "replication",
+                "source_path" : replication['source_root_path'],
+                "target_path" : f"{top_dir}{replication['target_root_path']}",
+                "address" : replication['target_address'],
+                "target_port" : replication['target_port'],
+                "map_local_ids_to_nfs_ids" : replication['map_local_ids_to_nfs_ids'],
+                "replication_mode" : replication['replication_mode'],
+                "snapshot_policies" : replication['snapshot_policies']
+                })
+        else:
+            actions.append({"action" : "skip", "section" : "replication", "source_path" : replication['source_root_path'], "reason" : "exists"})
         
     ########### NETWORK ########### 
     network_json_file = open('network.json','r')
     network_json_data = network_json_file.read()
     network_json_object = json.loads(network_json_data)
 
-    try:
-        interface = network_json_object['interface'][0]
-        rc.network.modify_interface(
-            interface_id=int(interface['id']), 
-            default_gateway=interface['default_gateway'], 
-            bonding_mode=interface['bonding_mode'], 
-            mtu=interface['mtu'])
-    except Exception as excpt:
-        logging.error(f'Error: {excpt}')    
-
-    try:
-        networks = network_json_object['networks']
-        for network in networks:
-            tenant_id = get_tenant_id(rc, network['tenant_name'])
-            if network['id'] == 1:
-                rc.network.modify_network(
-                    interface_id=interface['id'], 
-                    assigned_by = network['assigned_by'],
-                    network_id=network['id'], 
-                    name= network['name'], 
-                    floating_ip_ranges=network['floating_ip_ranges'], 
-                    dns_servers=network['dns_servers'], 
-                    dns_search_domains=network['dns_search_domains'],
-                    ip_ranges=network['ip_ranges'],
-                    netmask=network['netmask'],
-                    # mtu=network['mtu'],
-                    tenant_id = tenant_id,
-                    vlan_id=network['vlan_id'])
-            else:
-                rc.network.add_network(
-                    interface_id=interface['id'],  
-                    name= network['name'], 
-                    floating_ip_ranges=network['floating_ip_ranges'], 
-                    dns_servers=network['dns_servers'], 
-                    dns_search_domains=network['dns_search_domains'],
-                    ip_ranges=network['ip_ranges'],
-                    netmask=network['netmask'],
-                    # mtu=network['mtu'],
-                    tenant_id = tenant_id,
-                    vlan_id=network['vlan_id'])
-        logging.info(f'The network configurations are done.')
-    except Exception as excpt:
-        logging.error(f'Error: {excpt}')
+    interface = network_json_object['interface'][0]
+    existing_interfaces = {int(existing_interface['id']): existing_interface for existing_interface in rc.network.list_interfaces()}
+    action = {
+        "action" : "update",
+        "section" : "interface",
+        "interface_id" : int(interface['id']),
+        "default_gateway" : interface['default_gateway'],
+        "bonding_mode" : interface['bonding_mode'],
+        "mtu" : interface['mtu']
+        }
+    actions.append(skip_if(action, settings_match(existing_interfaces.get(int(interface['id'])), action, INTERFACE_FIELDS)))
+
+    # Networks are matched by name; the first network of an interface always
+    # exists, whatever its name
+    existing_networks = {}
+    if int(interface['id']) in existing_interfaces:
+        for existing_network in rc.network.list_networks(interface['id']):
+            existing_networks[existing_network['name']] = existing_network
+    for network in network_json_object['networks']:
+        action = {
+            "action" : "update" if network['id'] == 1 else "create",
+            "section" : "network",
+            "interface_id" : interface['id'],
+            "assigned_by" : network['assigned_by'],
+            "network_id" : network['id'],
+            "name" : network['name'],
+            "floating_ip_ranges" : network['floating_ip_ranges'],
+            "dns_servers" : network['dns_servers'],
+            "dns_search_domains" : network['dns_search_domains'],
+            "ip_ranges" : network['ip_ranges'],
+            "netmask" : network['netmask'],
+            "tenant_id" : tenants.id(network['tenant_name']),
+            "vlan_id" : network['vlan_id']
+            }
+        existing_network = existing_networks.get(network['name'])
+        if existing_network is not None:
+            action['action'] = 'update'
+            action['network_id'] = existing_network['id']
+        actions.append(skip_if(action, settings_match(existing_network, action, NETWORK_FIELDS)))
         
     ########### LDAP ########### 
     ldap_json_file = open('ldap.json','r')
     ldap_json_data = ldap_json_file.read()
-    ldap_json_object = json.loads(ldap_json_data)
-    
-    ldap = ldap_json_object
-    print("Please enter below details for LDAP join operations.")
-    username = input("LDAP Bind Username: ")
-    password = getpass("LDAP Bind Password: ")
-    try: 
-        rc.ldap.settings_set_v2(
-            use_ldap = ldap['use_ldap'],
-            bind_uri = ldap['bind_uri'],
-            user = username,
-            password = password,
-            base_distinguished_names = ldap['base_distinguished_names'],
-            ldap_schema = ldap['ldap_schema'],
-            #ldap_schema_description = ldap['ldap_schema_description'],
-            encrypt_connection = ldap['encrypt_connection']
-            )
-        logging.info(f'The AD configurations are done.')
-    except Exception as excpt:
-        logging.error(f'Error: {excpt}')
-
+    ldap = json.loads(ldap_json_data)
+    action = {
+        "action" : "update",
+        "section" : "ldap",
+        "use_ldap" : ldap['use_ldap'],
+        "bind_uri" : ldap['bind_uri'],
+        "base_distinguished_names" : ldap['base_distinguished_names'],
+        "ldap_schema" : ldap['ldap_schema'],
+        "encrypt_connection" : ldap['encrypt_connection']
+        }
+    actions.append(skip_if(action, settings_match(rc.ldap.settings_get_v2(), action, LDAP_FIELDS)))
 
     ########### AD ########### 
     ad_json_file = open('ad.json','r')
     ad_json_data = ad_json_file.read()
-    ad_json_object = json.loads(ad_json_data)
-
-    ad = ad_json_object
-    print("Please enter below details for AD join operations.")
-    username = input("AD Username: ")
-    password = getpass("AD Password: ")
-    try:
-        rc.ad.join_ad(
-            ad['domain'], 
-            username, 
-            password, 
-            ou=ad['ou'], 
-            domain_netbios=ad['domain_netbios'], 
-            enable_ldap=ad['use_ad_posix_attributes'], 
-            base_dn=ad['base_dn'])
-        logging.info(f'The AD configurations are done.')
-    except Exception as excpt:
-        logging.error(f'Error: {excpt}')
+    ad = json.loads(ad_json_data)
+    action = {
+        "action" : "create",
+        "section" : "ad",
+        "domain" : ad['domain'],
+        "ou" : ad['ou'],
+        "domain_netbios" : ad['domain_netbios'],
+        "enable_ldap" : ad['use_ad_posix_attributes'],
+        "base_dn" : ad['base_dn']
+        }
+    existing_ad = rc.ad.poll_ad()
+    if ad['domain'] == "":
+        skip_if(action, True, 'the primary is not joined to a domain')
+    else:
+        skip_if(action, existing_ad['status'] == 'JOINED_TO_DOMAIN' and existing_ad['domain'] == ad['domain'], 'already joined')
+    actions.append(action)
 
     ########### SNAPSHOT POLICIES ########### 
     snap_policy_json_file = open('snap_policy.json','r')
     snap_policy_json_data = snap_policy_json_file.read()
     snap_policy_json_object = json.loads(snap_policy_json_data)
-    try:
-        for snap_policy in snap_policy_json_object:
-            policy_name = snap_policy['policy_name']
-            snapshot_name_template = snap_policy['snapshot_name_template']
-            directory_path = snap_policy['directory_path']
-            directory_id = rc.fs.get_file_attr(directory_path)['id']
-            del snap_policy['schedule']['id']
-            schedule_info = snap_policy['schedule']
-            enabled_state = snap_policy['enabled']
-            lock_key_ref = snap_policy['lock_key_ref']
-            rc.snapshot.create_policy(
-                policy_name = policy_name, 
-                snapshot_name_template = snapshot_name_template,
-                schedule_info=schedule_info, 
-                enabled=enabled_state,
-                directory_id=directory_id,
-                lock_key_ref = lock_key_ref
-                )
-        logging.info(f'The snapshot policy configurations are done.')
-    except Exception as excpt:
-        logging.error(f'Error: {excpt}')
+    existing_policies = set()
+    if snap_policy_json_object != []:
+        existing_policies = {policy['policy_name'] for policy in rc.snapshot.list_policies()['entries']}
+    # Only the directories of the policies that are created are looked up
+    directory_ids = PathResolver(rc, cache=PathCache(rc)).ids([snap_policy['directory_path'] for snap_policy in snap_policy_json_object
+        if snap_policy['policy_name'] not in existing_policies])
+    for snap_policy in snap_policy_json_object:
+        directory_path = snap_policy['directory_path']
+        if snap_policy['policy_name'] in existing_policies:
+            actions.append({"action" : "skip", "section" : "snapshot_policy", "policy_name" : snap_policy['policy_name'], "reason" : "exists"})
+            continue
+        del snap_policy['schedule']['id']
+        action = {
+            "action" : "create",
+            "section" : "snapshot_policy",
+            "policy_name" : snap_policy['policy_name'],
+            "snapshot_name_template" : snap_policy['snapshot_name_template'],
+            "directory_path" : directory_path,
+            "schedule_info" : snap_policy['schedule'],
+            "enabled" : snap_policy['enabled'],
+            "lock_key_ref" : snap_policy['lock_key_ref']
+            }
+        directory_id, excpt = directory_ids[directory_path]
+        if excpt is None:
+            action['directory_id'] = directory_id
+        else:
+            logging.error(f'Error: {excpt}')
+            action['action'] = 'skip'
+            action['reason'] = f'{directory_path} lookup failed: {excpt}'
+        actions.append(action)
+    return actions
+
+# The action field that tells the actions of a section apart in the journal
+OTHERS_KEY_FIELDS = {
+    'replication' : 'source_path',
+    'interface' : 'interface_id',
+    'network' : 'name',
+    'snapshot_policy' : 'policy_name'
+}
+
+def others_key(action):
+    field = OTHERS_KEY_FIELDS.get(action['section'])
+    if field is None:
+        return action['section']
+    return f'{action["section"]}:{action[field]}'
+
+def others_apply(rc, actions, journal=None):
+    # Bind credentials are never written into a plan, so they are asked for
+    # once, right before the LDAP and AD actions run.
+    for action in actions:
+        section = action['section']
+        if journal is not None and journal.done(others_key(action)):
+            logging.info(f'A {section} action was completed by an earlier run.')
+            continue
+        if action['action'] == 'skip':
+            logging.info(f'A {section} action was skipped ({action["reason"]}).')
+            continue
+        try:
+            if section == 'ntp':
+                rc.time_config.set_time(
+                    use_ad_for_primary=action['use_ad_for_primary'], 
+                    ntp_servers=action['ntp_servers'])
+                logging.info(f'The NTP configurations are done.')
+            elif section == 'replication':
+                rc.replication.create_source_relationship(target_path=action['target_path'], address=action['address'], source_path=action['source_path'], map_local_ids_to_nfs_ids=action['map_local_ids_to_nfs_ids'], 
+                    target_port=action['target_port'], replication_mode=action['replication_mode'], snapshot_policies=action['snapshot_policies'])
+                logging.info(f'The replication relationship for {action["source_path"]} was created.')
+            elif section == 'interface':
+                rc.network.modify_interface(
+                    interface_id=action['interface_id'], 
+                    default_gateway=action['default_gateway'], 
+                    bonding_mode=action['bonding_mode'], 
+                    mtu=action['mtu'])
+            elif section == 'network' and action['action'] == 'update':
+                rc.network.modify_network(
+                    interface_id=action['interface_id'], 
+                    assigned_by = action['assigned_by'],
+                    network_id=action['network_id'], 
+                    name= action['name'], 
+                    floating_ip_ranges=action['floating_ip_ranges'], 
+                    dns_servers=action['dns_servers'], 
+                    dns_search_domains=action['dns_search_domains'],
+                    ip_ranges=action['ip_ranges'],
+                    netmask=action['netmask'],
+                    # mtu=network['mtu'],
+                    tenant_id = action['tenant_id'],
+                    vlan_id=action['vlan_id'])
+                logging.info(f'The network configurations are done.')
+            elif section == 'network':
+                rc.network.add_network(
+                    interface_id=action['interface_id'],  
+                    name= action['name'], 
+                    floating_ip_ranges=action['floating_ip_ranges'], 
+                    dns_servers=action['dns_servers'], 
+                    dns_search_domains=action['dns_search_domains'],
+                    ip_ranges=action['ip_ranges'],
+                    netmask=action['netmask'],
+                    # mtu=network['mtu'],
+                    tenant_id = action['tenant_id'],
+                    vlan_id=action['vlan_id'])
+                logging.info(f'The network configurations are done.')
+            elif section == 'ldap':
+                print("Please enter below details for LDAP join operations.")
+                username = input("LDAP Bind Username: ")
+                password = getpass("LDAP Bind Password: ")
+                rc.ldap.settings_set_v2(
+                    use_ldap = action['use_ldap'],
+                    bind_uri = action['bind_uri'],
+                    user = username,
+                    password = password,
+                    base_distinguished_names = action['base_distinguished_names'],
+                    ldap_schema = action['ldap_schema'],
+                    #ldap_schema_description = ldap['ldap_schema_description'],
+                    encrypt_connection = action['encrypt_connection']
+                    )
+                logging.info(f'The LDAP configurations are done.')
+            elif section == 'ad':
+                print("Please enter below details for AD join operations.")
+                username = input("AD Username: ")
+                password = getpass("AD Password: ")
+                rc.ad.join_ad(
+                    action['domain'], 
+                    username, 
+                    password, 
+                    ou=action['ou'], 
+                    domain_netbios=action['domain_netbios'], 
+                    enable_ldap=action['enable_ldap'], 
+                    base_dn=action['base_dn'])
+                logging.info(f'The AD configurations are done.')
+            elif section == 'snapshot_policy':
+                rc.snapshot.create_policy(
+                    policy_name = action['policy_name'], 
+                    snapshot_name_template = action['snapshot_name_template'],
+                    schedule_info=action['schedule_info'], 
+                    enabled=action['enabled'],
+                    directory_id=action['directory_id'],
+                    lock_key_ref = action['lock_key_ref']
+                    )
+                logging.info(f'The snapshot policy {action["policy_name"]} was created.')
+            if journal is not None:
+                journal.record(others_key(action))
+        except Exception as excpt:
+            logging.error(f'Error: {excpt}')
+
+def others_define(rc, approve, tenants=None, journal=None):
+    others_apply(rc, others_plan(rc, tenants), journal)
 
 if __name__ == '__main__':
     main(sys.argv[1:])
@@ -0,0 +1,212 @@
+import sys
+import json
+import time
+import logging
+import getopt
+from common import DUMP_FORMATS, dump_file_name, load_records
+from quotas import quota_key
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+def main(argv):
+    # Logging Details
+    logging.basicConfig(filename='operation.log', level=logging.DEBUG,
+        format='%(asctime)s,%(levelname)s,%(message)s')
+    # define a Handler which writes INFO messages or higher to the sys.stderr
+    console = logging.StreamHandler()
+    console.setLevel(logging.INFO)
+    # add the handler to the root logger
+    logging.getLogger('').addHandler(console)
+
+    # Argument Parameters Details
+    err_msg = '''
+usage: quota_analytics.py [--format FORMAT] [--threshold PERCENT] [--top N] [--depth N] [--only PATTERN] [--output FILE]
+
+Report the capacity utilization of the directory quotas in a quota dump written by quotas.py -d. Needs NumPy (pip install numpy).
+
+optional arguments:
+-h, --help          Show this help message and exit
+--format FORMAT     Format of the quota dump: json (default), jsonl, jsonl.gz or jsonl.zst.
+--threshold PERCENT Quotas at or above this utilization are listed as over the threshold (default: 90).
+--top N             Number of the fullest quotas over the threshold and of the largest directory rollups that are reported (default: 20).
+--depth N           Roll the quotas up by the first N directories of their path (default: 1).
+--only PATTERN      Only analyze the quotas whose path starts with PATTERN, or matches it when it contains *, ? or [. Can be given more than once.
+--output FILE       Write the report as JSON into FILE (default: quota_analytics.json).
+    '''
+    try:
+        opts, args = getopt.getopt(argv,'h',["help","format=","threshold=","top=","depth=","only=","output="])
+    except getopt.GetoptError:
+        print (err_msg)
+        sys.exit(2)
+
+    dump_format = 'json'
+    threshold = 90.0
+    top = 20
+    depth = 1
+    only = []
+    output = 'quota_analytics.json'
+    try:
+        for opt, arg in opts:
+            if opt in ("-h","--help"):
+                print (err_msg)
+                sys.exit()
+            elif opt == "--format":
+                if arg not in DUMP_FORMATS:
+                    raise ValueError(arg)
+                dump_format = arg
+            elif opt == "--threshold":
+                threshold = float(arg)
+            elif opt == "--top":
+                top = max(1, int(arg))
+            elif opt == "--depth":
+                depth = max(1, int(arg))
+            elif opt == "--only":
+                only.append(arg)
+            elif opt == "--output":
+                output = arg
+    except ValueError:
+        print (err_msg)
+        sys.exit(2)
+
+    if np is None:
+        logging.error('quota_analytics.py needs NumPy, please install it with: pip install numpy')
+        sys.exit(2)
+
+    start = time.perf_counter()
+    columns = quota_columns(load_records('quotas', dump_format, only, quota_key), depth)
+    loaded = time.perf_counter()
+    report = quota_report(columns, threshold, depth, top)
+    logging.info(f'{len(columns["path"])} directory quotas from {dump_file_name("quotas", dump_format)} were loaded in '
+        f'{loaded - start:.2f} seconds and analyzed in {time.perf_counter() - loaded:.3f} seconds')
+    print_report(report)
+    output_file = open(output, 'w')
+    json.dump(report, output_file, indent=4)
+    output_file.close()
+    logging.info(f'The report was written into {output}')
+
+def quota_columns(quotas, depth=1):
+    '''Return the path, limit, usage, path depth and rollup group of the quotas as NumPy arrays'''
+    paths = []
+    limits = []
+    usages = []
+    path_depths = []
+    group_ids = {}
+    group = []
+    for quota in quotas:
+        fs_path = quota['path']
+        paths.append(fs_path)
+        limits.append(quota['limit'])
+        usages.append(quota['capacity_usage'])
+        # The group of a quota is its path up to its `depth`th directory;
+        # quotas less deep than that are their own group.
+        directories = [directory for directory in fs_path.split('/') if directory]
+        path_depths.append(len(directories))
+        group.append(group_ids.setdefault('/' + '/'.join(directories[:depth]), len(group_ids)))
+
+    # Paths are kept as objects: a fixed width string array would be as wide
+    # as the longest path for every quota.
+    path = np.array(paths, dtype=object)
+    # The API returns the sizes as decimal strings
+    limit = np.fromiter(map(int, limits), dtype=np.int64, count=len(limits))
+    usage = np.fromiter(map(int, usages), dtype=np.int64, count=len(usages))
+    path_depth = np.array(path_depths, dtype=np.int64)
+
+    # Groups are numbered in the order of their names, so rollups with the
+    # same usage are listed by name
+    groups = sorted(group_ids)
+    renumber = np.empty(len(groups), dtype=np.int64)
+    renumber[[group_ids[name] for name in groups]] = np.arange(len(groups))
+    group = renumber[np.array(group, dtype=np.int64)]
+    return {"path" : path, "limit" : limit, "usage" : usage, "depth" : path_depth, "group" : group, "groups" : groups}
+
+def utilization(usage, limit):
+    '''Usage in percent of limit, 0 where the limit is 0'''
+    return np.divide(usage * 100.0, limit, out=np.zeros(len(limit)), where=limit > 0)
+
+def quota_report(columns, threshold=90.0, depth=1, top=20):
+    '''Return the utilization report of the quota columns, with the `top` fullest quotas and largest directories'''
+    path = columns['path']
+    limit = columns['limit']
+    usage = columns['usage']
+    used = utilization(usage, limit)
+    report = {
+        "quotas" : len(path),
+        "total_limit" : int(limit.sum()),
+        "total_usage" : int(usage.sum()),
+        "utilization" : round(float(utilization(usage.sum(keepdims=True), limit.sum(keepdims=True))[0]), 2),
+        "threshold" : threshold,
+    }
+
+    # Utilization distribution: 10% buckets, and everything at or over the
+    # limit in one bucket
+    edges = np.array([0, 10, 20, 30, 40, 50, 60, 70, 80, 90, 100, np.inf])
+    counts, edges = np.histogram(used, bins=edges)
+    labels = [f'{int(low)}-{int(high)}%' for low, high in zip(edges[:-2], edges[1:-1])] + ['>=100%']
+    report['distribution'] = dict(zip(labels, counts.tolist()))
+    if len(path):
+        report['percentiles'] = dict(zip(['p50', 'p90', 'p99', 'max'], np.round(np.percentile(used, [50, 90, 99, 100]), 2).tolist()))
+    report['depths'] = {str(level): count for level, count in enumerate(np.bincount(columns['depth']).tolist()) if count}
+
+    # Quotas over the threshold, fullest first. Only the `top` fullest are
+    # picked out and sorted.
+    over = np.flatnonzero(used >= threshold)
+    fullest = over
+    if len(over) > top:
+        fullest = over[np.argpartition(-used[over], top - 1)[:top]]
+    order = fullest[np.argsort(-used[fullest], kind='stable')]
+    report['over_threshold'] = len(over)
+    report['over_threshold_quotas'] = [
+        {"path" : str(path[index]), "limit" : int(limit[index]), "usage" : int(usage[index]), "utilization" : round(float(used[index]), 2)}
+        for index in order]
+
+    # Per directory rollups, largest usage first
+    groups = columns['groups']
+    inverse = columns['group']
+    group_counts = np.bincount(inverse, minlength=len(groups))
+    by_group = np.argsort(inverse, kind='stable')
+    starts = np.concatenate(([0], np.cumsum(group_counts)[:-1])).astype(np.int64)
+    group_limit = np.add.reduceat(limit[by_group], starts) if len(path) else limit[:0]
+    group_usage = np.add.reduceat(usage[by_group], starts) if len(path) else usage[:0]
+    group_used = utilization(group_usage, group_limit)
+    group_over = np.bincount(inverse, weights=used >= threshold, minlength=len(groups)).astype(np.int64)
+    report['rollup_depth'] = depth
+    report['directories'] = len(groups)
+    report['rollups'] = [
+        {"directory" : groups[index], "quotas" : int(group_counts[index]), "limit" : int(group_limit[index]),
+            "usage" : int(group_usage[index]), "utilization" : round(float(group_used[index]), 2), "over_threshold" : int(group_over[index])}
+        for index in np.argsort(-group_usage, kind='stable')[:top]]
+    return report
+
+def size(value):
+    for unit in ['B', 'KiB', 'MiB', 'GiB', 'TiB']:
+        if abs(value) < 1024:
+            return f'{value:.1f} {unit}'
+        value /= 1024
+    return f'{value:.1f} PiB'
+
+def print_report(report):
+    print ()
+    print (f'{report["quotas"]} directory quotas, {size(report["total_usage"])} used of {size(report["total_limit"])} ({report["utilization"]}%)')
+    if 'percentiles' in report:
+        print ('utilization ' + ', '.join(f'{name} {value}%' for name, value in report['percentiles'].items()))
+    print ()
+    print (f'{"utilization":<12} {"quotas":>9}')
+    for label, count in report['distribution'].items():
+        print (f'{label:<12} {count:>9}')
+    print ()
+    shown = len(report['over_threshold_quotas'])
+    print (f'{report["over_threshold"]} quotas are at or over {report["threshold"]}%' + (f', the fullest {shown}:' if report['over_threshold'] > shown else ':' if shown else ''))
+    for quota in report['over_threshold_quotas']:
+        print (f'{quota["utilization"]:>8.2f}%  {size(quota["usage"]):>12} of {size(quota["limit"]):>12}  {quota["path"]}')
+    print ()
+    print (f'{report["directories"]} directories at depth {report["rollup_depth"]}' + (f', the largest {len(report["rollups"])}:' if report['directories'] > len(report['rollups']) else ':'))
+    print (f'{"directory":<40} {"quotas":>8} {"usage":>12} {"limit":>12} {"used":>8} {"over":>6}')
+    for rollup in report['rollups']:
+        print (f'{rollup["directory"]:<40} {rollup["quotas"]:>8} {size(rollup["usage"]):>12} {size(rollup["limit"]):>12} '
+            f'{rollup["utilization"]:>7.2f}% {rollup["over_threshold"]:>6}')
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
@@ -9,6 +9,7 @@ import qumulo.rest
 import time
 import sys, getopt
 from getpass import getpass
+from common import DUMP_FORMATS, DumpWriter, load_records, PathCache, PathResolver, create_directories, run_parallel, write_plan, read_plan, enable_profiling, instrument, Journal, DumpScope
 
 def main(argv):
     # Logging Details
@@ -22,20 +23,34 @@ def main(argv):
 
     # Argument Parameters Details 
     err_msg = '''
-usage: qumulo_sync.py [-a|--auto_approve] [-d|--dump] [-s|--set] 
+usage: quotas.py [-a|--auto_approve] [--format FORMAT] [--jsonl] [--workers N] [-d|--dump] [-s|--set] [--plan FILE] [--apply FILE] [--profile] [--resume] [--only PATTERN] [--path PREFIX]
 
-Dump or Set SMB settings and shares. 
+Dump or Set directory quotas. 
 
 optional arguments:
 -h, --help          Show this help message and exit
 -a, --auto_approve  Sync all existing settings without confirmation. If you want to use it, please put it before other arguments.
--d, --dump          Dump SMB settings and shares.
--s, --set           Sent SMB settings and shares.
+--format FORMAT     Dump file format: json (default), jsonl, jsonl.gz or jsonl.zst. The jsonl formats hold one quota per line, gzip or zstd compressed for the last two (zstd needs the zstandard package). Use the same format for --dump and --set. If you want to use it, please put it before other arguments.
+--jsonl             Same as --format jsonl.
+--workers N         Number of parallel API requests used by --set (default: 1). If you want to use it, please put it before other arguments.
+-d, --dump          Dump directory quotas.
+-s, --set           Set directory quotas.
+--plan FILE         Write the changes --set would make into a plan file, without changing anything.
+--apply FILE        Apply a plan file written by --plan without confirmation.
+--profile           Print per-endpoint API call counts and latencies at exit and write them into quotas_profile.json. If you want to use it, please put it before other arguments.
+--resume            Skip what an interrupted -s or --apply run against the same cluster already completed, as recorded in quotas_journal.jsonl. If you want to use it, please put it before -s or --apply.
+--only PATTERN      Only set the quotas whose directory path that start with PATTERN, or match it when it contains *, ? or [. Can be given more than once. If you want to use it, please put it before -s or --plan.
+--path PREFIX       Only dump the quotas whose file system path is PREFIX or below it. Can be given more than once. If you want to use it, please put it before -d.
     '''
     try:
         if len(sys.argv) > 1:
-            opts, args = getopt.getopt(argv,'hads :',["help","auto_approve","dump","set"])
+            opts, args = getopt.getopt(argv,'hads :',["help","auto_approve","format=","jsonl","workers=","dump","set","plan=","apply=","profile","resume","only=","path="])
             approve = False
+            resume = False
+            only = []
+            scope_paths = []
+            dump_format = 'json'
+            workers = 1
         else:
             print(err_msg)
             sys.exit(2)
@@ -51,14 +66,43 @@ optional arguments:
         elif opt in ("-d","--dump"):
             prc = login('primary')
             print ()
-            quota_list(prc)
+            quota_list(prc, dump_format, DumpScope(paths=scope_paths))
         elif opt in ("-a","--auto_approve"):
             approve = True
+        elif opt == "--format":
+            if arg not in DUMP_FORMATS:
+                print (err_msg)
+                sys.exit(2)
+            dump_format = arg
+        elif opt == "--jsonl":
+            dump_format = 'jsonl'
+        elif opt == "--workers":
+            try:
+                workers = max(1, int(arg))
+            except ValueError:
+                print (err_msg)
+                sys.exit(2)
+        elif opt == "--plan":
+            src = login('secondary')
+            print ()
+            write_plan(arg, 'quotas', src, quota_plan(src, dump_format, workers, only=only))
+        elif opt == "--path":
+            scope_paths.append(arg)
+        elif opt == "--only":
+            only.append(arg)
+        elif opt == "--resume":
+            resume = True
+        elif opt == "--profile":
+            enable_profiling('quotas_profile.json')
+        elif opt == "--apply":
+            src = login('secondary')
+            print ()
+            quota_apply(src, read_plan(arg, 'quotas', src), True, workers, Journal('quotas', src, resume))
         else:            
             if opt in ("-s","--set"):
                 src = login('secondary')
                 print ()
-                quota_define(src, approve)
+                quota_define(src, approve, dump_format, workers, Journal('quotas', src, resume), only)
 
 def login(cluster):
     # Cluster address is one of the IP addresses of the cluster nodes that is required for the API connectivity
@@ -71,6 +115,7 @@ def login(cluster):
     port = ""
     username = ""
     password = ""
+    node_balancing = None
 
     if path.exists('credentials.json') == True:
         json_file = open('credentials.json','r')
@@ -93,6 +138,8 @@ def login(cluster):
         if password == "":
             password = getpass(cluster.capitalize() +  " Password: ")
 
+        node_balancing = json_object[cluster].get('node_balancing')
+
     else:
         print()
         cluster_address = input(cluster.capitalize() + " Cluster address: ")
@@ -107,75 +154,190 @@ def login(cluster):
         rc.login(username, password)
         logging.info(f'Connection established with {cluster_address}')
         
-        return rc
+        return instrument(rc, node_balancing)
 
     except Exception as excpt:
         logging.error(f'Connection issue with {cluster_address}')
         logging.error(f'Error: {excpt}')
         sys.exit(1)
         
-def quota_list(rc):
-    quotas=list(rc.quota.get_all_quotas_with_status(page_size=1000))[0]['quotas']
-    quota_json_file = open('quotas.json', 'w')
-    json.dump(quotas, quota_json_file, indent=4)
-    quota_json_file.close()
-    logging.info(f'Totally {len(quotas)} directory quotas were added into the JSON file')
-    
-def quota_define(rc, approve):
-    approve = False
-    quota_json_file = open('quotas.json','r')
-    quota_json_data = quota_json_file.read()
-    quota_json_object = json.loads(quota_json_data)
-    
-    quotas = quota_json_object
-    for x in range(len(quotas)):
-        fs_path = quotas[x]['path']
-        limit = quotas[x]['limit']
-        try: 
-            file_id = rc.fs.get_file_attr(fs_path)['id']
-            try:
-                rc.quota.get_quota(file_id)
-                print ("Quota for "+ fs_path + " is already defined... ")
-                logging.info(f'{fs_path} quota is already defined.')
-                if approve == False:
-                    update_confirm = input("Do you want to update "+ fs_path +" directory quota?: [Y/n]")
-                else:
-                    update_confirm = "Y"
-                    print("Directory quota for " + fs_path + " is being updated...")
-                    logging.info(f'Directory quota for {fs_path} was updated succesfully.')
-            
-                if update_confirm in ["y","Y","Yes","yes"]:
-                    rc.quota.update_quota(file_id, limit)
-                else:
-                    print("Directory quota for " + fs_path + " wasn't updated...")
-                    logging.info(f'Directory quota for {fs_path} wasn\'t updated.')
-            except: 
-                    if approve == False:
-                        create_confirm = input("Do you want to create "+ fs_path +" directory quota?: [Y/n]")
-                    else:
-                        create_confirm = "Y"
-                        print("Directory quota for " + fs_path + " is being created...")
-                
-                    if create_confirm == "y" or create_confirm == "Y" or create_confirm == "Yes" or create_confirm == "yes": 
-                        rc.quota.create_quota(file_id, limit)
-                        logging.info(f'A new directory quota was created for {fs_path}')
-
-        except qumulo.lib.request.RequestError as excpt:
-            if (excpt.status_code == 404):
-                print (f"Directory {fs_path} does not exist on the cluster.")
+def quota_key(quota):
+    return quota['path']
+
+def quota_list(rc, dump_format='json', scope=None):
+    # Every page is written out as soon as it arrives, so the whole quota list
+    # is never held in memory and clusters with more than one page of quotas
+    # are dumped completely.
+    quota_writer = DumpWriter('quotas', dump_format, key=quota_key)
+    for page in rc.quota.get_all_quotas_with_status(page_size=1000):
+        for quota in page['quotas']:
+            if scope is None or scope.includes(fs_path=quota['path']):
+                quota_writer.write(quota)
+        quota_writer.flush()
+        logging.debug(f'{quota_writer.count} directory quotas were written so far')
+    quota_writer.close()
+    logging.info(f'Totally {quota_writer.count} directory quotas were added into {quota_writer.file_name}')
+
+def quota_records(rc):
+    '''Yield every directory quota on the cluster of rc, one page at a time'''
+    for page in rc.quota.get_all_quotas_with_status(page_size=1000):
+        for quota in page['quotas']:
+            yield quota
+
+def quota_index(rc, quotas=None):
+    # A single paginated listing of the destination quotas, keyed by directory
+    # path and by file id, replaces the get_file_attr/get_quota pair that used
+    # to be sent for every quota in the dump.
+    by_path = {}
+    by_id = {}
+    for quota in quota_records(rc) if quotas is None else quotas:
+        by_path[quota['path']] = quota
+        by_id[quota['id']] = quota
+    return by_path, by_id
+
+def quota_classify(fs_path, limit, by_path, by_id, file_id):
+    '''Return ("create" | "update" | "unchanged", file_id) for a dumped quota'''
+    existing = by_path.get(fs_path)
+    if existing is None:
+        existing = by_id.get(file_id)
+        if existing is None:
+            return 'create', file_id
+    if str(existing['limit']) == str(limit):
+        return 'unchanged', existing['id']
+    return 'update', existing['id']
+
+def quota_plan(rc, dump_format='json', workers=1, journal=None, only=None):
+    '''Return the create/update/skip action for every quota in the dump'''
+    def quotas():
+        # The dump is streamed twice instead of being held in memory. Quotas
+        # set by an interrupted run are not looked up again.
+        for quota in load_records('quotas', dump_format, only, quota_key):
+            if journal is None or not journal.done(quota['path']):
+                yield quota
+    return quota_actions(rc, quotas, workers)
+
+def quota_actions(rc, quotas, workers=1, index=None):
+    '''Return the create/update/skip action for every quota quotas() yields.
+
+    quotas is called twice. index is the (by_path, by_id) pair quota_index
+    returns, if the destination quotas were already listed.
+    '''
+    by_path, by_id = index if index is not None else quota_index(rc)
+    logging.info(f'{len(by_path)} directory quotas were found on the destination')
+
+    # Only directories without a quota on the destination need a lookup, and
+    # those lookups run in parallel. Ids remembered from earlier runs against
+    # this cluster are revalidated in bulk instead. A 404 means the directory
+    # itself is missing on the destination.
+    file_ids = PathResolver(rc, workers, cache=PathCache(rc)).ids([quota['path'] for quota in quotas() if quota['path'] not in by_path])
+
+    actions = []
+    for quota in quotas():
+        fs_path = quota['path']
+        limit = quota['limit']
+        file_id, excpt = file_ids.get(fs_path, (None, None))
+        if excpt is not None:
+            if isinstance(excpt, qumulo.lib.request.RequestError) and excpt.status_code == 404:
                 logging.info(f'Directory {fs_path} does not exist on destination.')
+                actions.append({"action" : "create", "path" : fs_path, "file_id" : None, "limit" : limit, "create_directory" : True})
+            else:
+                logging.error(f'Directory quota for {fs_path} couldn\'t be checked: {excpt}')
+                actions.append({"action" : "skip", "path" : fs_path, "limit" : limit, "reason" : f"lookup failed: {excpt}"})
+            continue
+
+        action, file_id = quota_classify(fs_path, limit, by_path, by_id, file_id)
+        if action == 'unchanged':
+            actions.append({"action" : "skip", "path" : fs_path, "file_id" : file_id, "limit" : limit, "reason" : "unchanged"})
+        else:
+            actions.append({"action" : action, "path" : fs_path, "file_id" : file_id, "limit" : limit})
+    return actions
+
+def quota_apply(rc, actions, approve, workers=1, journal=None):
+    # Confirmations stay interactive and in plan order; approved operations
+    # are collected and applied afterwards.
+    operations = []
+    skipped = 0
+    missing = []
+    for action in actions:
+        fs_path = action['path']
+        if journal is not None and journal.done(fs_path):
+            skipped += 1
+            logging.debug(f'Directory quota for {fs_path} was set by an earlier run.')
+        elif action['action'] == 'skip':
+            skipped += 1
+            logging.debug(f'Directory quota for {fs_path} was skipped ({action["reason"]}).')
+        elif action.get('create_directory'):
+            print (f"Directory {fs_path} does not exist on the cluster.")
+            if approve == False:
                 create_dir = input("Do you want to create"+ fs_path +" directory?: [Y/n]")
-                if create_dir in ['y','Y','Yes','yes']:
-                    fs_path_splitted = fs_path.split("/")
-                    name = fs_path_splitted[-2]
-                    path = '/'.join(fs_path_splitted[:-2])
-                    if path == "":
-                        path = "/"
-                    rc.fs.create_directory(dir_path=path, name=name)
-                    file_id = rc.fs.get_file_attr(fs_path)['id']
-                    rc.quota.create_quota(file_id, limit)
             else:
-                print ("Error: %s" % excpt)
-            
+                create_dir = "Y"
+                print("Directory " + fs_path + " is being created...")
+
+            if create_dir in ['y','Y','Yes','yes']:
+                missing.append(action)
+        elif action['action'] == 'update':
+            print ("Quota for "+ fs_path + " is already defined... ")
+            logging.info(f'{fs_path} quota is already defined.')
+            if approve == False:
+                update_confirm = input("Do you want to update "+ fs_path +" directory quota?: [Y/n]")
+            else:
+                update_confirm = "Y"
+                print("Directory quota for " + fs_path + " is being updated...")
+
+            if update_confirm in ["y","Y","Yes","yes"]:
+                operations.append(action)
+            else:
+                print("Directory quota for " + fs_path + " wasn't updated...")
+                logging.info(f'Directory quota for {fs_path} wasn\'t updated.')
+        else:
+            if approve == False:
+                create_confirm = input("Do you want to create "+ fs_path +" directory quota?: [Y/n]")
+            else:
+                create_confirm = "Y"
+                print("Directory quota for " + fs_path + " is being created...")
+
+            if create_confirm in ["y","Y","Yes","yes"]:
+                operations.append(action)
+
+    # The missing directories and their missing parents are created together,
+    # one depth at a time, before any of their quotas.
+    directories = create_directories(rc, [action['path'] for action in missing], workers)
+    created = []
+    for action in missing:
+        file_id, dir_excpt = directories[action['path']]
+        if dir_excpt is not None:
+            logging.error(f'Directory {action["path"]} couldn\'t be created: {dir_excpt}')
+        else:
+            created.append((action['path'], file_id))
+            operations.append(dict(action, file_id=file_id))
+    PathCache(rc).put(created)
+
+    def apply(client, operation):
+        if operation['action'] == 'update':
+            client.quota.update_quota(operation['file_id'], operation['limit'])
+        else:
+            client.quota.create_quota(operation['file_id'], operation['limit'])
+        if journal is not None:
+            journal.record(operation['path'])
+
+    results = run_parallel(rc, apply, operations, workers)
+
+    failed = 0
+    for operation, (result, excpt) in zip(operations, results):
+        fs_path = operation['path']
+        if excpt is not None:
+            failed += 1
+            logging.error(f'Directory quota for {fs_path} couldn\'t be {operation["action"]}d: {excpt}')
+        elif operation['action'] == 'update':
+            logging.info(f'Directory quota for {fs_path} was updated succesfully.')
+        else:
+            logging.info(f'A new directory quota was created for {fs_path}')
+    logging.info(f'{skipped} directory quotas were skipped')
+    logging.info(f'Totally {len(operations) - failed} directory quotas were applied, {failed} failed')
+
+def quota_define(rc, approve, dump_format='json', workers=1, journal=None, only=None):
+    quota_apply(rc, quota_plan(rc, dump_format, workers, journal, only), approve, workers, journal)
+
 if __name__ == '__main__':
     main(sys.argv[1:])
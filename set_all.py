@@ -0,0 +1,168 @@
+import sys
+import json
+import time
+import logging
+import getopt
+from os import path
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from common import Journal, enable_profiling, DUMP_FORMATS
+from quotas import login, quota_define
+from users import users_define
+from nfs_exports import nfs_define
+from smb_shares import smb_define
+
+def main(argv):
+    # Logging Details
+    logging.basicConfig(filename='operation.log', level=logging.DEBUG,
+        format='%(asctime)s,%(levelname)s,%(message)s')
+    # define a Handler which writes INFO messages or higher to the sys.stderr
+    console = logging.StreamHandler()
+    console.setLevel(logging.INFO)
+    # add the handler to the root logger
+    logging.getLogger('').addHandler(console)
+
+    # Argument Parameters Details
+    err_msg = '''
+usage: set_all.py [--to LIST] [--format FORMAT] [--workers N] [--profile] [--sections LIST] [--resume] [--only PATTERN]
+
+Set the dumped users, quotas, NFS exports and SMB shares on several clusters at once, without confirmation.
+
+optional arguments:
+-h, --help          Show this help message and exit
+--to LIST           Comma separated names of the destination clusters in credentials.json (default: the "destinations" list in credentials.json, or secondary).
+--format FORMAT     Format of the dump files: json (default), jsonl, jsonl.gz or jsonl.zst.
+--workers N         Number of parallel quota requests per cluster (default: 1).
+--profile           Print per-endpoint API call counts and latencies of all clusters at exit and write them into set_all_profile.json.
+--sections LIST     Comma separated subset of users,quotas,nfs,smb (default: all).
+--resume            Continue an interrupted run. Each cluster and section has its own journal, <section>_<cluster>_journal.jsonl.
+--only PATTERN      Only set the objects that start with PATTERN, or match it when it contains *, ? or [. Can be given more than once.
+    '''
+    try:
+        opts, args = getopt.getopt(argv,'h',["help","to=","format=","workers=","profile","sections=","resume","only="])
+    except getopt.GetoptError:
+        print (err_msg)
+        sys.exit(2)
+
+    destinations = None
+    dump_format = 'json'
+    workers = 1
+    sections = list(SECTIONS)
+    resume = False
+    only = []
+    for opt, arg in opts:
+        if opt in ("-h","--help"):
+            print (err_msg)
+            sys.exit()
+        elif opt == "--to":
+            destinations = arg.split(',')
+        elif opt == "--format":
+            if arg not in DUMP_FORMATS:
+                print (err_msg)
+                sys.exit(2)
+            dump_format = arg
+        elif opt == "--workers":
+            try:
+                workers = max(1, int(arg))
+            except ValueError:
+                print (err_msg)
+                sys.exit(2)
+        elif opt == "--profile":
+            enable_profiling('set_all_profile.json')
+        elif opt == "--sections":
+            sections = [section for section in SECTIONS if section in arg.split(',')]
+            for section in arg.split(','):
+                if section not in SECTIONS:
+                    print (f'Unknown section: {section}')
+                    sys.exit(2)
+        elif opt == "--resume":
+            resume = True
+        elif opt == "--only":
+            only.append(arg)
+
+    if destinations is None:
+        destinations = destination_names()
+    for destination in destinations:
+        if path.exists('credentials.json') and destination not in credentials():
+            print (f'{destination} is not defined in credentials.json')
+            sys.exit(2)
+    # Logins may ask for missing credentials, so they are done one by one
+    # before the clusters are set in parallel.
+    clusters = {}
+    for destination in destinations:
+        clusters[destination] = login(destination)
+    print ()
+    results = set_all(clusters, sections, dump_format, workers, resume, only)
+    print_report(results)
+    if any(result['error'] is not None for sections in results.values() for result in sections.values()):
+        sys.exit(1)
+
+def credentials():
+    json_file = open('credentials.json','r')
+    json_object = json.load(json_file)
+    json_file.close()
+    return json_object
+
+def destination_names():
+    if path.exists('credentials.json'):
+        return credentials().get('destinations', ['secondary'])
+    return ['secondary']
+
+# section name -> function(rc, journal, dump_format, workers, only), in the
+# order they are set on each cluster: quotas may create the directories the
+# exports and shares point to.
+SECTIONS = {
+    'users' : lambda rc, journal, dump_format, workers, only: users_define(rc, True, journal, dump_format, only),
+    'quotas' : lambda rc, journal, dump_format, workers, only: quota_define(rc, True, dump_format, workers, journal, only),
+    'nfs' : lambda rc, journal, dump_format, workers, only: nfs_define(rc, True, None, journal, dump_format, only),
+    'smb' : lambda rc, journal, dump_format, workers, only: smb_define(rc, True, None, journal, dump_format, only),
+}
+
+def set_cluster(rc, destination, sections, dump_format, workers, resume, only):
+    results = {}
+    for section in sections:
+        start = time.perf_counter()
+        error = None
+        journal = None
+        try:
+            journal = Journal(f'{section}_{destination}', rc, resume)
+            SECTIONS[section](rc, journal, dump_format, workers, only)
+        except (Exception, SystemExit) as excpt:
+            # A missing dump or a journal of another cluster exits the
+            # scripts; here it only fails this section of this cluster.
+            error = excpt if isinstance(excpt, Exception) else f'stopped with exit status {excpt.code}'
+        if journal is not None:
+            journal.close()
+        results[section] = {"seconds" : time.perf_counter() - start, "error" : error,
+            "applied" : journal.recorded if journal is not None else 0}
+        if error is None:
+            logging.info(f'{destination}: {section} were set in {results[section]["seconds"]:.1f} seconds')
+        else:
+            logging.error(f'{destination}: setting {section} failed: {error}')
+    return results
+
+def set_all(clusters, sections, dump_format='json', workers=1, resume=False, only=None):
+    # Every cluster has its own session and thread and goes through the
+    # sections in order, so setting N clusters takes about as long as the
+    # slowest of them.
+    results = {}
+    with ThreadPoolExecutor(max_workers=len(clusters)) as executor:
+        futures = {}
+        for destination, rc in clusters.items():
+            logging.info(f'Setting {destination} was started')
+            futures[executor.submit(set_cluster, rc, destination, sections, dump_format, workers, resume, only)] = destination
+        for future in as_completed(futures):
+            destination = futures[future]
+            results[destination] = future.result()
+            logging.info(f'Setting {destination} was completed ({len(results)}/{len(clusters)})')
+    return {destination: results[destination] for destination in clusters}
+
+def print_report(results):
+    print ()
+    print (f'{"cluster":<16} {"section":<8} {"seconds":>9} {"applied":>8}  status')
+    for destination, sections in results.items():
+        for section, result in sections.items():
+            status = 'OK' if result['error'] is None else f'FAILED: {result["error"]}'
+            print (f'{destination:<16} {section:<8} {result["seconds"]:>9.2f} {result["applied"]:>8}  {status}')
+
+if __name__ == '__main__':
+    main(sys.argv[1:])
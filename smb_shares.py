@@ -8,8 +8,8 @@ import qumulo.lib.request
 import qumulo.rest
 import time
 import sys, getopt
-import jmespath
 from getpass import getpass
+from common import TenantMap, run_parallel, write_plan, read_plan, enable_profiling, instrument, Journal, DumpScope, DUMP_FORMATS, DumpWriter, load_records, dump_file_name, key_matches, stream
 
 def main(argv):
     # Logging Details
@@ -23,20 +23,38 @@ def main(argv):
     
     # Argument Parameters Details 
     err_msg = '''
-usage: qumulo_sync.py [-a|--auto_approve] [-d|--dump] [-s|--set] 
+usage: smb_shares.py [-a|--auto_approve] [--format FORMAT] [--workers N] [-d|--dump] [-s|--set] [--sync] [--plan FILE] [--apply FILE] [--profile] [--resume] [--only PATTERN] [--tenant NAME] [--path PREFIX] [--name PATTERN]
 
 Dump or Set SMB settings and shares. 
 
 optional arguments:
 -h, --help          Show this help message and exit
 -a, --auto_approve  Sync all existing settings without confirmation. If you want to use it, please put it before other arguments.
+--format FORMAT     Dump file format: json (default), jsonl, jsonl.gz or jsonl.zst. The jsonl formats hold one share per line, gzip or zstd compressed for the last two (zstd needs the zstandard package). Use the same format for --dump and --set. If you want to use it, please put it before other arguments.
+--workers N         Number of parallel API requests used by --dump and --sync (default: 8). If you want to use it, please put it before other arguments.
 -d, --dump          Dump SMB settings and shares.
--s, --set           Sent SMB settings and shares.
+-s, --set           Set SMB shares.
+--sync              Set the SMB shares of the primary cluster on the secondary cluster directly, without dump files. The secondary is set while the primary is still being read. Confirmations and --resume work as for --set.
+--plan FILE         Write the changes --set would make into a plan file, without changing anything.
+--apply FILE        Apply a plan file written by --plan without confirmation.
+--profile           Print per-endpoint API call counts and latencies at exit and write them into smb_shares_profile.json. If you want to use it, please put it before other arguments.
+--resume            Skip what an interrupted -s or --apply run against the same cluster already completed, as recorded in smb_journal.jsonl. If you want to use it, please put it before -s or --apply.
+--only PATTERN      Only set the shares whose name that start with PATTERN, or match it when it contains *, ? or [. Can be given more than once. If you want to use it, please put it before -s or --plan.
+--tenant NAME       Only dump or sync the shares of this tenant. Can be given more than once. If you want to use it, please put it before -d or --sync.
+--path PREFIX       Only dump or sync the shares whose file system path is PREFIX or below it. Can be given more than once. If you want to use it, please put it before -d or --sync.
+--name PATTERN      Only dump or sync the shares whose share name starts with PATTERN, or matches it when it contains *, ? or [. Can be given more than once. If you want to use it, please put it before -d or --sync.
     '''
     try:
         if len(sys.argv) > 1:
-            opts, args = getopt.getopt(argv,'hads :',["help","auto_approve","dump","set"])
+            opts, args = getopt.getopt(argv,'hads :',["help","auto_approve","format=","workers=","dump","set","sync","plan=","apply=","profile","resume","only=","tenant=","path=","name="])
             approve = False
+            resume = False
+            only = []
+            scope_tenants = []
+            scope_paths = []
+            scope_names = []
+            dump_format = 'json'
+            workers = 8
         else:
             print(err_msg)
             sys.exit(2)
@@ -52,14 +70,50 @@ optional arguments:
         elif opt in ("-d","--dump"):
             prc = login('primary')
             print ()
-            smb_list(prc)
+            smb_list(prc, workers=workers, dump_format=dump_format, scope=DumpScope(scope_tenants, scope_paths, scope_names))
         elif opt in ("-a","--auto_approve"):
             approve = True
+        elif opt == "--workers":
+            try:
+                workers = max(1, int(arg))
+            except ValueError:
+                print (err_msg)
+                sys.exit(2)
+        elif opt == "--plan":
+            src = login('secondary')
+            print ()
+            write_plan(arg, 'smb', src, smb_plan(src, dump_format=dump_format, only=only))
+        elif opt == "--sync":
+            prc = login('primary')
+            src = login('secondary')
+            print ()
+            smb_sync(prc, src, approve, Journal('smb', src, resume), workers=workers, scope=DumpScope(scope_tenants, scope_paths, scope_names))
+        elif opt == "--format":
+            if arg not in DUMP_FORMATS:
+                print (err_msg)
+                sys.exit(2)
+            dump_format = arg
+        elif opt == "--tenant":
+            scope_tenants.append(arg)
+        elif opt == "--path":
+            scope_paths.append(arg)
+        elif opt == "--name":
+            scope_names.append(arg)
+        elif opt == "--only":
+            only.append(arg)
+        elif opt == "--resume":
+            resume = True
+        elif opt == "--profile":
+            enable_profiling('smb_shares_profile.json')
+        elif opt == "--apply":
+            src = login('secondary')
+            print ()
+            smb_apply(src, read_plan(arg, 'smb', src), True, Journal('smb', src, resume))
         else:            
             if opt in ("-s","--set"):
                 src = login('secondary')
                 print ()
-                smb_define(src, approve)
+                smb_define(src, approve, journal=Journal('smb', src, resume), dump_format=dump_format, only=only)
 
 def login(cluster):
     # Cluster address is one of the IP addresses of the cluster nodes that is required for the API connectivity
@@ -72,6 +126,7 @@ def login(cluster):
     port = ""
     username = ""
     password = ""
+    node_balancing = None
 
     if path.exists('credentials.json') == True:
         json_file = open('credentials.json','r')
@@ -94,6 +149,8 @@ def login(cluster):
         if password == "":
             password = getpass(cluster.capitalize() +  " Password: ")
 
+        node_balancing = json_object[cluster].get('node_balancing')
+
     else:
         print()
         cluster_address = input(cluster.capitalize() + " Cluster address: ")
@@ -109,7 +166,7 @@ def login(cluster):
         print ("Connection established with " + cluster_address)
         logging.info(f'Connection established with {cluster_address}')
 
-        return (rc)
+        return instrument(rc, node_balancing)
 
     except Exception as excpt:
         logging.error(f'Connection issue with {cluster_address}')
@@ -138,26 +195,48 @@ def loosen_trustees(permissions):
         loose_permissions.append(permission)
     return loose_permissions
 
-def get_tenant_name(rc, tenant_id):
-    tenants = rc.multitenancy.list_tenants()
-    for tenant in tenants:
-        if tenant_id == tenant.id:
-            return tenant.name
+# Share fields the dump needs. The bulk listing normally returns all of them,
+# so a share is only fetched again on its own when one is missing.
+SMB_SHARE_FIELDS = (
+    'share_name', 'fs_path', 'description', 'access_based_enumeration_enabled',
+    'default_file_create_mode', 'default_directory_create_mode',
+    'require_encryption', 'network_permissions', 'tenant_id', 'permissions')
 
-def get_tenant_id(rc, tenant_name):
-    tenants = rc.multitenancy.list_tenants()
-    for tenant in tenants:
-        if tenant_name == tenant.name:
-            return tenant.id  
+def smb_key(share):
+    return share['share_name']
 
-def smb_list(rc):
+def share_in_scope(share, tenants, scope):
+    tenant = tenants.name(share['tenant_id']) if 'tenant_id' in share else None
+    return scope.includes(tenant, share.get('fs_path'), share.get('share_name'))
+
+def smb_records(rc, tenants=None, workers=8, scope=None):
+    '''Yield the dump record of every share on the cluster of rc'''
+    if tenants is None:
+        tenants = TenantMap(rc)
     smb_shares=rc.smb.smb_list_shares(populate_trustee_names=True)['entries']
-    shares = []
-    count = 0
+    if scope is not None:
+        # Out of scope shares are dropped before any detail request. A share
+        # the listing didn't fully describe is checked again once fetched.
+        smb_shares = [share for share in smb_shares if share_in_scope(share, tenants, scope)]
+
+    incomplete = [share for share in smb_shares if any(field not in share for field in SMB_SHARE_FIELDS)]
+    details = {}
+    if incomplete != []:
+        logging.info(f'{len(incomplete)} SMB shares need a separate detail request')
+        results = run_parallel(
+            rc, lambda client, share: client.smb.smb_list_share(share_id=share['id']), incomplete, workers)
+        for share, (share_details, excpt) in zip(incomplete, results):
+            if excpt is not None:
+                logging.error(f'{share["share_name"]} configurations couldn\'t be listed: {excpt}')
+            else:
+                details[share['id']] = share_details
+
     for share in smb_shares:
-        share_details = {}
-        id_ = share['id']
-        share_details = rc.smb.smb_list_share(share_id=id_)
+        share_details = details.get(share['id'], share)
+        if any(field not in share_details for field in SMB_SHARE_FIELDS):
+            continue
+        if scope is not None and not share_in_scope(share_details, tenants, scope):
+            continue
         share_details = {
             "share_name" : share_details['share_name'],
             "fs_path" : share_details['fs_path'],
@@ -168,50 +247,117 @@ def smb_list(rc):
             "default_directory_create_mode" : share_details['default_directory_create_mode'],
             "require_encryption" : share_details['require_encryption'],
             "network_permissions" : share_details['network_permissions'],
-            "tenant_name" : get_tenant_name(rc, share_details['tenant_id']),
+            "tenant_name" : tenants.name(share_details['tenant_id']),
             "permissions" : loosen_trustees(share_details['permissions'])
         }
-        shares.append(share_details)
-        logging.info(f'{share["share_name"]} configurations was listed')
+        yield share_details
+
+def smb_list(rc, tenants=None, workers=8, dump_format='json', scope=None):
+    # smb.json holds the settings and the shares in one document. The jsonl
+    # formats hold one share per line, and the settings go into
+    # smb_settings.json.
+    if dump_format == 'json':
+        shares = []
+    else:
+        shares = DumpWriter('smb', dump_format, key=smb_key)
+    count = 0
+    for share_details in smb_records(rc, tenants, workers, scope):
+        if dump_format == 'json':
+            shares.append(share_details)
+        else:
+            shares.write(share_details)
+        logging.info(f'{share_details["share_name"]} configurations was listed')
         count +=1
-    logging.info(f'Totally {count} SMB share were added into the JSON file')
     smb_settings = rc.smb.get_smb_settings()
-    smb_dump = {
-        "smb_settings" : smb_settings,
-        "smb_shares" : shares
-    }
-    smb_json_file = open('smb.json', 'w')
-    json.dump(smb_dump, smb_json_file, indent=4)
-    smb_json_file.close()
-
-def smb_define(rc, approve):
-    smb_json_file = open('smb.json','r')
-    smb_json_data = smb_json_file.read()
-    smb_json_object = json.loads(smb_json_data)
-
-    shares = smb_json_object['smb_shares']
-    count = 0
-    for share in shares:
-        share_name = share['share_name']
-        fs_path = share['fs_path']
-        description = share['description']
-        allow_fs_path_create = share['allow_fs_path_create']
-        access_based_enumeration_enabled = share['access_based_enumeration_enabled']
-        default_file_create_mode = share['default_file_create_mode']
-        default_directory_create_mode = share['default_directory_create_mode']
-        permissions = share['permissions']
-        require_encryption = share['require_encryption']
-        tenant_id = get_tenant_id(rc, share['tenant_name'])
-        network_permissions = share['network_permissions']
-
-        smb_shares = rc.smb.smb_list_shares(populate_trustee_names=True)['entries']
-        existing_share = jmespath.search(
-            f"[?share_name == '{share_name}']", smb_shares
+    if dump_format == 'json':
+        smb_dump = {
+            "smb_settings" : smb_settings,
+            "smb_shares" : shares
+        }
+        smb_json_file = open('smb.json', 'w')
+        json.dump(smb_dump, smb_json_file, indent=4)
+        smb_json_file.close()
+    else:
+        shares.close()
+        smb_json_file = open('smb_settings.json', 'w')
+        json.dump(smb_settings, smb_json_file, indent=4)
+        smb_json_file.close()
+    logging.info(f'Totally {count} SMB share were added into {dump_file_name("smb", dump_format)}')
+
+def smb_share_changed(existing_share, action):
+    # A share the listing didn't fully describe is updated to be safe
+    if any(field not in existing_share for field in SMB_SHARE_FIELDS):
+        return True
+    return (
+        existing_share['fs_path'] != action['fs_path'] or
+        existing_share['description'] != action['description'] or
+        existing_share['access_based_enumeration_enabled'] != action['access_based_enumeration_enabled'] or
+        existing_share['default_file_create_mode'] != action['default_file_create_mode'] or
+        existing_share['default_directory_create_mode'] != action['default_directory_create_mode'] or
+        existing_share['require_encryption'] != action['require_encryption'] or
+        existing_share['network_permissions'] != action['network_permissions'] or
+        existing_share['tenant_id'] != action['tenant_id'] or
+        loosen_trustees(existing_share['permissions']) != action['permissions']
         )
-        
-        if existing_share != []:
-            edited_permissions = loosen_trustees(permissions)
-            share_id = existing_share[0]["id"]
+
+def smb_plan(rc, tenants=None, dump_format='json', only=None):
+    '''Return the create/update/skip action for every share in the dump'''
+    if dump_format == 'json':
+        smb_json_file = open('smb.json','r')
+        smb_json_data = smb_json_file.read()
+        smb_json_object = json.loads(smb_json_data)
+        # smb.json has no index, the shares are filtered as they are read
+        shares = [share for share in smb_json_object['smb_shares'] if not only or key_matches(smb_key(share), only)]
+    else:
+        shares = load_records('smb', dump_format, only, smb_key)
+    return list(smb_actions(rc, shares, tenants))
+
+def smb_actions(rc, shares, tenants=None):
+    '''Yield the create/update/skip action for every share record, against the cluster of rc'''
+    if tenants is None:
+        tenants = TenantMap(rc)
+    existing_shares = {}
+    for existing_share in rc.smb.smb_list_shares(populate_trustee_names=True)['entries']:
+        existing_shares[existing_share['share_name']] = existing_share
+
+    for share in shares:
+        action = {
+            "action" : "create",
+            "share_name" : share['share_name'],
+            "fs_path" : share['fs_path'],
+            "description" : share['description'],
+            "access_based_enumeration_enabled" : share['access_based_enumeration_enabled'],
+            "default_file_create_mode" : share['default_file_create_mode'],
+            "default_directory_create_mode" : share['default_directory_create_mode'],
+            "permissions" : loosen_trustees(share['permissions']),
+            "require_encryption" : share['require_encryption'],
+            "tenant_id" : tenants.id(share['tenant_name']),
+            "network_permissions" : share['network_permissions']
+        }
+        existing_share = existing_shares.get(share['share_name'])
+        if existing_share is not None:
+            action['share_id'] = existing_share['id']
+            if smb_share_changed(existing_share, action):
+                action['action'] = 'update'
+            else:
+                action['action'] = 'skip'
+                action['reason'] = 'unchanged'
+        yield action
+
+def smb_apply(rc, actions, approve, journal=None):
+    count = 0
+    unchanged = 0
+    for action in actions:
+        share_name = action['share_name']
+        if journal is not None and journal.done(share_name):
+            logging.debug(f'{share_name} SMB share was set by an earlier run.')
+            continue
+        if action['action'] == 'skip':
+            unchanged += 1
+            logging.debug(f'{share_name} SMB share is already up to date.')
+            continue
+
+        if action['action'] == 'update':
             print (share_name + " SMB share is already defined... ")
             logging.info(f'{share_name} - SMB share is already defined.')
 
@@ -221,23 +367,25 @@ def smb_define(rc, approve):
                 update_confirm = "Y"
                 print(share_name + " share configuration is being updated...")
             
-            if update_confirm == "y" or update_confirm == "Y" or update_confirm == "Yes" or update_confirm == "yes":
+            if update_confirm in ["y","Y","Yes","yes"]:
                 rc.smb.smb_modify_share(
-                    share_id = share_id,
+                    share_id = action['share_id'],
                     share_name = share_name,
-                    fs_path = fs_path,
-                    description = description,
-                    permissions = edited_permissions,
+                    fs_path = action['fs_path'],
+                    description = action['description'],
+                    permissions = action['permissions'],
                     allow_fs_path_create=False,
-                    tenant_id = tenant_id,
-                    access_based_enumeration_enabled = access_based_enumeration_enabled,
-                    default_file_create_mode = default_file_create_mode,
-                    default_directory_create_mode = default_directory_create_mode,
-                    require_encryption = require_encryption,
-                    network_permissions = network_permissions
+                    tenant_id = action['tenant_id'],
+                    access_based_enumeration_enabled = action['access_based_enumeration_enabled'],
+                    default_file_create_mode = action['default_file_create_mode'],
+                    default_directory_create_mode = action['default_directory_create_mode'],
+                    require_encryption = action['require_encryption'],
+                    network_permissions = action['network_permissions']
                     )
                 print("OK")
                 logging.info(f'{share_name} share configuration was updated.')
+                if journal is not None:
+                    journal.record(share_name)
             else:
                 print(share_name + " share wasn't updated...")
                 logging.info(f'{share_name} share wasn\'t updated.')
@@ -250,20 +398,34 @@ def smb_define(rc, approve):
             
             if create_confirm in ["y","Y","Yes","yes"]:
                 rc.smb.smb_add_share(
-                    share_name = share['share_name'],
-                    fs_path = share['fs_path'],
-                    description = share['description'],
+                    share_name = share_name,
+                    fs_path = action['fs_path'],
+                    description = action['description'],
                     allow_fs_path_create = True,
-                    access_based_enumeration_enabled = share['access_based_enumeration_enabled'],
-                    default_file_create_mode = share['default_file_create_mode'],
-                    default_directory_create_mode = share['default_directory_create_mode'],
-                    permissions = share['permissions'],
-                    require_encryption = share['require_encryption'],
-                    tenant_id = get_tenant_id(rc, share['tenant_name']),
-                    network_permissions = share['network_permissions']
+                    access_based_enumeration_enabled = action['access_based_enumeration_enabled'],
+                    default_file_create_mode = action['default_file_create_mode'],
+                    default_directory_create_mode = action['default_directory_create_mode'],
+                    permissions = action['permissions'],
+                    require_encryption = action['require_encryption'],
+                    tenant_id = action['tenant_id'],
+                    network_permissions = action['network_permissions']
                 )
-                logging.info('{} share configuration was created.'.format(share['share_name']))
+                logging.info('{} share configuration was created.'.format(share_name))
+                if journal is not None:
+                    journal.record(share_name)
         count +=1
-    logging.info(f'Totally {count} NFS exports were added into the JSON file')
+    logging.info(f'Totally {count} SMB shares were processed')
+    logging.info(f'{unchanged} SMB shares were already up to date and skipped')
+
+def smb_define(rc, approve, tenants=None, journal=None, dump_format='json', only=None):
+    smb_apply(rc, smb_plan(rc, tenants, dump_format, only), approve, journal)
+
+def smb_sync(prc, src, approve, journal=None, workers=8, scope=None):
+    # No dump file: the primary's shares are listed, completed and turned
+    # into dump records by a thread of their own and handed over through a
+    # bounded queue, so the secondary is set while the primary is still being
+    # read.
+    smb_apply(src, smb_actions(src, stream(smb_records(prc, workers=workers, scope=scope))), approve, journal)
+
 if __name__ == '__main__':
     main(sys.argv[1:])
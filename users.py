@@ -7,9 +7,9 @@ import qumulo.lib.auth
 import qumulo.lib.request
 import qumulo.rest
 import time
-import jmespath
 import sys, getopt
 from getpass import getpass
+from common import write_plan, read_plan, enable_profiling, instrument, Journal, DumpScope, DUMP_FORMATS, DumpWriter, load_records
 
 def main(argv):
     # Logging Details
@@ -18,20 +18,31 @@ def main(argv):
 
     # Argument Parameters Details 
     err_msg = '''
-usage: users.py [-a|--auto_approve] [-d|--dump] [-s|--set] 
+usage: users.py [-a|--auto_approve] [--format FORMAT] [-d|--dump] [-s|--set] [--plan FILE] [--apply FILE] [--profile] [--resume] [--only PATTERN] [--name PATTERN]
 
 Dump or Set local users (without password). 
 
 optional arguments:
 -h, --help          Show this help message and exit
 -a, --auto_approve  Sync all existing settings without confirmation. If you want to use it, please put it before other arguments.
+--format FORMAT     Dump file format: json (default), jsonl, jsonl.gz or jsonl.zst. The jsonl formats hold one user per line, gzip or zstd compressed for the last two (zstd needs the zstandard package). Use the same format for --dump and --set. If you want to use it, please put it before other arguments.
 -d, --dump          Dump local users.
 -s, --set           Set local users.
+--plan FILE         Write the changes --set would make into a plan file, without changing anything.
+--apply FILE        Apply a plan file written by --plan without confirmation.
+--profile           Print per-endpoint API call counts and latencies at exit and write them into users_profile.json. If you want to use it, please put it before other arguments.
+--resume            Skip what an interrupted -s or --apply run against the same cluster already completed, as recorded in users_journal.jsonl. If you want to use it, please put it before -s or --apply.
+--only PATTERN      Only set the users whose name that start with PATTERN, or match it when it contains *, ? or [. Can be given more than once. If you want to use it, please put it before -s or --plan.
+--name PATTERN      Only dump the users whose name starts with PATTERN, or matches it when it contains *, ? or [. Can be given more than once. If you want to use it, please put it before -d.
     '''
     try:
         if len(sys.argv) > 1:
-            opts, args = getopt.getopt(argv,'hads :',["help","auto_approve","dump","set"])
+            opts, args = getopt.getopt(argv,'hads :',["help","auto_approve","format=","dump","set","plan=","apply=","profile","resume","only=","name="])
             approve = False
+            resume = False
+            only = []
+            scope_names = []
+            dump_format = 'json'
         else:
             print(err_msg)
             sys.exit(2)
@@ -47,14 +58,35 @@ optional arguments:
         elif opt in ("-d","--dump"):
             prc = login('primary')
             print ()
-            users_list(prc)
+            users_list(prc, dump_format, DumpScope(names=scope_names))
         elif opt in ("-a","--auto_approve"):
             approve = True
+        elif opt == "--plan":
+            src = login('secondary')
+            print ()
+            write_plan(arg, 'users', src, users_plan(src, dump_format=dump_format, only=only))
+        elif opt == "--format":
+            if arg not in DUMP_FORMATS:
+                print (err_msg)
+                sys.exit(2)
+            dump_format = arg
+        elif opt == "--name":
+            scope_names.append(arg)
+        elif opt == "--only":
+            only.append(arg)
+        elif opt == "--resume":
+            resume = True
+        elif opt == "--profile":
+            enable_profiling('users_profile.json')
+        elif opt == "--apply":
+            src = login('secondary')
+            print ()
+            users_apply(src, read_plan(arg, 'users', src), True, Journal('users', src, resume))
         else:            
             if opt in ("-s","--set"):
                 src = login('secondary')
                 print ()
-                users_define(src, approve)
+                users_define(src, approve, Journal('users', src, resume), dump_format, only)
 
 def login(cluster):
     # Cluster address is one of the IP addresses of the cluster nodes that is required for the API connectivity
@@ -67,6 +99,7 @@ def login(cluster):
     port = ""
     username = ""
     password = ""
+    node_balancing = None
 
     if path.exists('credentials.json') == True:
         json_file = open('credentials.json','r')
@@ -89,6 +122,8 @@ def login(cluster):
         if password == "":
             password = getpass(cluster.capitalize() +  " Password: ")
 
+        node_balancing = json_object[cluster].get('node_balancing')
+
     else:
         print()
         cluster_address = input(cluster.capitalize() + " Cluster address: ")
@@ -104,7 +139,7 @@ def login(cluster):
         print ("Connection established with " + cluster_address)
         logging.info('Connection established with {}'.format(cluster_address))
 
-        return (rc)
+        return instrument(rc, node_balancing)
 
     except Exception as excpt:
         logging.error('Connection issue with {}'.format(cluster_address))
@@ -112,34 +147,99 @@ def login(cluster):
         print(__doc__)
         sys.exit(1)
 
-def users_list(rc):
-    users = rc.users.list_users()
-    users_json_file = open('users.json', 'w')
-    json.dump(users, users_json_file, indent=4)
-    users_json_file.close()
+def user_key(user):
+    return user['name']
+
+def users_list(rc, dump_format='json', scope=None):
+    users_writer = DumpWriter('users', dump_format, key=user_key)
+    for user in rc.users.list_users():
+        if scope is None or scope.includes(name=user['name']):
+            users_writer.write(user)
+    users_writer.close()
+    logging.info(f'Totally {users_writer.count} users were added into {users_writer.file_name}')
       
 
-def users_define(rc, approve):
-    approve = False
-    users_json_file = open('users.json','r')
-    users_json_data = users_json_file.read()
-    users_json_object = json.loads(users_json_data)
-    
-    users = users_json_object
+def users_reconcile(users, existing_users):
+    '''Split the dumped users into creates, updates, unchanged and conflicts'''
+    # The destination users are indexed once by uid and by name, so every
+    # dumped user is matched with two dictionary lookups.
+    by_uid = {}
+    by_name = {}
+    for existing_user in existing_users:
+        if existing_user['uid'] != "":
+            by_uid[existing_user['uid']] = existing_user
+        by_name[existing_user['name']] = existing_user
+
+    creates = []
+    updates = []
+    unchanged = []
+    conflicts = []
     for user in users:
-        
-        primary_group = user['primary_group']
-        if user['uid'] != "":
-            uid = user['uid']
+        same_name = by_name.get(user['name'])
+        same_uid = by_uid.get(user['uid']) if user['uid'] != "" else None
+        if same_name is None and same_uid is None:
+            creates.append(user)
+        elif same_name is not None and same_name['uid'] == user['uid']:
+            if (same_name['primary_group'] == user['primary_group'] and
+                    same_name['home_directory'] == user['home_directory']):
+                unchanged.append(user)
+            else:
+                updates.append((same_name['id'], user))
+        elif same_name is not None and same_name['uid'] == "" and same_uid is None:
+            # A user created without its uid only needs the uid set.
+            updates.append((same_name['id'], user))
         else:
-            uid = None
-        home_directory = user['home_directory']
-        password = "Admin123"
-        name = user['name']
-
-        existing_users = rc.users.list_users() 
-        existing_user_check = jmespath.search(f"[?uid == '{uid}' || name == '{name}'].[uid, name]", existing_users)
-        if existing_user_check != [] :
+            # The name or the uid is already taken by a different user.
+            conflicts.append(user)
+    return creates, updates, unchanged, conflicts
+
+def users_plan(rc, journal=None, dump_format='json', only=None):
+    '''Return the create/update/skip action for every user in the dump'''
+    users = load_records('users', dump_format, only, user_key)
+    if journal is not None:
+        users = (user for user in users if not journal.done(user['name']))
+    creates, updates, unchanged, conflicts = users_reconcile(users, rc.users.list_users())
+    logging.info('{} users to create, {} to update, {} unchanged, {} in conflict'.format(
+        len(creates), len(updates), len(unchanged), len(conflicts)))
+
+    actions = []
+    for user in conflicts:
+        logging.warning('User {} (uid {}) conflicts with an existing user by name or uid.'.format(user['name'], user['uid']))
+        actions.append({"action" : "skip", "name" : user['name'], "reason" : "conflict"})
+    for user in unchanged:
+        actions.append({"action" : "skip", "name" : user['name'], "reason" : "unchanged"})
+    for user_id, user in updates:
+        actions.append({
+            "action" : "update",
+            "user_id" : user_id,
+            "name" : user['name'],
+            "primary_group" : user['primary_group'],
+            "uid" : user['uid'] if user['uid'] != "" else None,
+            "home_directory" : user['home_directory']
+            })
+    for user in creates:
+        actions.append({
+            "action" : "create",
+            "name" : user['name'],
+            "primary_group" : user['primary_group'],
+            "uid" : user['uid'] if user['uid'] != "" else None,
+            "home_directory" : user['home_directory']
+            })
+    return actions
+
+def users_apply(rc, actions, approve, journal=None):
+    password = "Admin123"
+    for action in actions:
+        name = action['name']
+        if journal is not None and journal.done(name):
+            logging.debug('User {} was set by an earlier run.'.format(name))
+            continue
+        if action['action'] == 'skip':
+            if action['reason'] == 'conflict':
+                print (name + " conflicts with an existing user on the destination, skipped...")
+            continue
+
+        if action['action'] == 'update':
             print (name + " is already defined... ")
             logging.info('{} user is already defined.'.format(name))
             if approve == False:
@@ -147,20 +247,16 @@ def users_define(rc, approve):
             else:
                 update_confirm = "Y"
                 print(name + " is being updated...")
-                logging.info('User {} was updated succesfully.'.format(name))
         
-            if update_confirm == "y" or update_confirm == "Y" or update_confirm == "Yes" or update_confirm == "yes":
-                #password = getpass("Enter user password for "+name+" : ")
-                checked_name = jmespath.search(f"[?uid == '{uid}'].[name]", existing_users)
-                checked_uid = jmespath.search(f"[?name == '{name}'].[uid]", existing_users)
-                if name == checked_name and uid == checked_uid:
-                    user_id = jmespath.search(f"[?uid == '{uid}'].[id]", existing_users)
-                    rc.users.modify_user(user_id, name, primary_group, uid, home_directory=home_directory, password=password)
-                else:
-                    continue
+            if update_confirm in ["y","Y","Yes","yes"]:
+                # The password of an existing user is left as it is
+                rc.users.modify_user(action['user_id'], name, action['primary_group'], action['uid'], home_directory=action['home_directory'], password=None)
+                logging.info('User {} was updated succesfully.'.format(name))
+                if journal is not None:
+                    journal.record(name)
             else:
                 print(name + " wasn't updated...")
-            logging.info('User {} wasn\'t updated.'.format(name))
+                logging.info('User {} wasn\'t updated.'.format(name))
         else:
             if approve == False:
                 create_confirm = input("Do you want to create "+ name +" user?: [Y/n]")
@@ -168,13 +264,18 @@ def users_define(rc, approve):
                 create_confirm = "Y"
                 print(name+ " is being created...")
         
-            if create_confirm == "y" or create_confirm == "Y" or create_confirm == "Yes" or create_confirm == "yes": 
+            if create_confirm in ["y","Y","Yes","yes"]:
                 #password = getpass("Enter user password for "+name+" : ")
-                rc.users.add_user(name, primary_group, password, uid=None, home_directory=None) 
+                rc.users.add_user(name, action['primary_group'], password, uid=action.get('uid'), home_directory=action.get('home_directory'))
                 print("A new user was created (" + name +")")
                 logging.info('A new user was created ({})'.format(name))
+                if journal is not None:
+                    journal.record(name)
         print ()
 
+def users_define(rc, approve, journal=None, dump_format='json', only=None):
+    users_apply(rc, users_plan(rc, journal, dump_format, only), approve, journal)
+
 if __name__ == '__main__':
     main(sys.argv[1:])
 
@@ -0,0 +1,229 @@
+import sys
+import json
+import time
+import hashlib
+import logging
+import getopt
+from datetime import datetime, timezone
+from common import TenantMap, enable_profiling
+from quotas import login, quota_records, quota_index, quota_actions, quota_apply
+from nfs_exports import nfs_records, nfs_actions, nfs_apply
+from smb_shares import smb_records, smb_actions, smb_apply
+
+def main(argv):
+    # Logging Details
+    logging.basicConfig(filename='operation.log', level=logging.DEBUG,
+        format='%(asctime)s,%(levelname)s,%(message)s')
+    # define a Handler which writes INFO messages or higher to the sys.stderr
+    console = logging.StreamHandler()
+    console.setLevel(logging.INFO)
+    # add the handler to the root logger
+    logging.getLogger('').addHandler(console)
+
+    # Argument Parameters Details
+    err_msg = '''
+usage: watch.py [--sections LIST] [--interval [SECTION=]SECONDS] [--events FILE] [--sync] [--workers N] [--once] [--profile]
+
+Watch the secondary cluster for NFS exports, SMB shares and quotas that drift from the primary cluster.
+
+optional arguments:
+-h, --help          Show this help message and exit
+--sections LIST     Comma separated subset of nfs,smb,quotas (default: all).
+--interval SECONDS  Seconds between two checks of every section (default: 60). With SECTION=SECONDS, for example quotas=600, only for that section. Can be given more than once.
+--events FILE       Append every drift event as one JSON line into FILE (default: watch_events.jsonl).
+--sync              Set every object that drifted on the secondary cluster as it is on the primary, without confirmation.
+--workers N         Number of parallel requests for SMB share details and quota changes (default: 8).
+--once              Check every section once and exit, with exit status 1 if anything drifted.
+--profile           Print per-endpoint API call counts and latencies at exit and write them into watch_profile.json.
+    '''
+    try:
+        opts, args = getopt.getopt(argv,'h',["help","sections=","interval=","events=","sync","workers=","once","profile"])
+    except getopt.GetoptError:
+        print (err_msg)
+        sys.exit(2)
+
+    sections = list(SECTIONS)
+    intervals = {section: 60 for section in SECTIONS}
+    events_file = 'watch_events.jsonl'
+    sync = False
+    workers = 8
+    once = False
+    try:
+        for opt, arg in opts:
+            if opt in ("-h","--help"):
+                print (err_msg)
+                sys.exit()
+            elif opt == "--sections":
+                sections = arg.split(',')
+                for section in sections:
+                    if section not in SECTIONS:
+                        print (f'Unknown section: {section}')
+                        sys.exit(2)
+            elif opt == "--interval":
+                if '=' in arg:
+                    section, seconds = arg.split('=', 1)
+                    if section not in SECTIONS:
+                        print (f'Unknown section: {section}')
+                        sys.exit(2)
+                    intervals[section] = max(1.0, float(seconds))
+                else:
+                    intervals = {section: max(1.0, float(arg)) for section in SECTIONS}
+            elif opt == "--events":
+                events_file = arg
+            elif opt == "--sync":
+                sync = True
+            elif opt == "--workers":
+                workers = max(1, int(arg))
+            elif opt == "--once":
+                once = True
+            elif opt == "--profile":
+                enable_profiling('watch_profile.json')
+    except ValueError:
+        print (err_msg)
+        sys.exit(2)
+
+    prc = login('primary')
+    src = login('secondary')
+    print ()
+    watcher = DriftWatcher(prc, src, events_file, sync, workers)
+    if once:
+        drifted = [watcher.check(section) for section in sections]
+        sys.exit(1 if any(drifted) else 0)
+    watcher.run({section: intervals[section] for section in sections})
+
+def fingerprint(record):
+    '''sha256 of the canonical JSON form of a record'''
+    return hashlib.sha256(json.dumps(record, sort_keys=True, separators=(',', ':')).encode()).hexdigest()
+
+# section -> (records(rc, tenants, workers), key(record), compared(record))
+# The records are the ones the dumps write, so tenants are compared by name
+# and SMB trustees without their cluster specific ids. A quota's usage
+# changes all the time and its id is a file id, so only its limit counts.
+SECTIONS = {
+    'nfs' : (lambda rc, tenants, workers: nfs_records(rc, tenants),
+             lambda export: f'{export["tenant_name"]}:{export["export_path"]}',
+             lambda export: export),
+    'smb' : (lambda rc, tenants, workers: smb_records(rc, tenants, workers),
+             lambda share: share['share_name'],
+             lambda share: share),
+    'quotas' : (lambda rc, tenants, workers: quota_records(rc),
+                lambda quota: quota['path'],
+                lambda quota: {"path" : quota['path'], "limit" : str(quota['limit'])}),
+}
+
+class DriftWatcher:
+    '''Compares the sections of two clusters by the fingerprints of their objects.
+
+    Every check lists a section on both clusters and fingerprints each
+    object. Only objects whose drift is new, or has changed since the last
+    check of the section, are reported. With sync, every object that is
+    still drifted is set on the secondary cluster, so one that failed to be
+    set is tried again on the next check.
+    '''
+    def __init__(self, prc, src, events_file, sync=False, workers=8):
+        self.prc = prc
+        self.src = src
+        self.primary_tenants = TenantMap(prc)
+        self.secondary_tenants = TenantMap(src)
+        self.events_file = events_file
+        self.sync = sync
+        self.workers = workers
+        # section -> {key: (primary fingerprint, secondary fingerprint)}
+        self.drift = {section: {} for section in SECTIONS}
+
+    def list(self, rc, tenants, section):
+        records, key, compared = SECTIONS[section]
+        fingerprints = {}
+        objects = {}
+        for record in records(rc, tenants, self.workers):
+            fingerprints[key(record)] = fingerprint(compared(record))
+            objects[key(record)] = record
+        return fingerprints, objects
+
+    def check(self, section):
+        '''Check one section, report what changed and return whether anything drifted'''
+        start = time.perf_counter()
+        primary, primary_objects = self.list(self.prc, self.primary_tenants, section)
+        secondary, secondary_objects = self.list(self.src, self.secondary_tenants, section)
+        drift = {}
+        for key in primary.keys() | secondary.keys():
+            if primary.get(key) != secondary.get(key):
+                drift[key] = (primary.get(key), secondary.get(key))
+
+        previous = self.drift[section]
+        changed = [key for key in drift if previous.get(key) != drift[key]]
+        resolved = [key for key in previous if key not in drift]
+        events = []
+        for key in sorted(changed):
+            primary_fingerprint, secondary_fingerprint = drift[key]
+            if secondary_fingerprint is None:
+                state = 'missing'
+            elif primary_fingerprint is None:
+                state = 'extra'
+            else:
+                state = 'changed'
+            events.append({"event" : "drifted", "state" : state, "key" : key,
+                "primary" : primary_fingerprint, "secondary" : secondary_fingerprint})
+        for key in sorted(resolved):
+            events.append({"event" : "resolved", "key" : key})
+        self.emit(section, events)
+        self.drift[section] = drift
+        # A check that finds nothing new only goes into operation.log
+        level = logging.INFO if events != [] else logging.DEBUG
+        logging.log(level, f'{section}: {len(primary)} objects on the primary, {len(secondary)} on the secondary, '
+            f'{len(drift)} drifted, {len(changed)} new, {len(resolved)} resolved ({time.perf_counter() - start:.2f} seconds)')
+
+        # Objects that only exist on the secondary are reported, but never
+        # deleted, as the set scripts never delete anything either.
+        if self.sync:
+            self.apply(section, [primary_objects[key] for key in sorted(drift) if key in primary_objects], secondary_objects)
+        return drift != {}
+
+    def apply(self, section, records, secondary_objects):
+        if records == []:
+            return
+        logging.info(f'{section}: {len(records)} drifted objects are being set on the secondary')
+        try:
+            if section == 'nfs':
+                nfs_apply(self.src, nfs_actions(self.src, records, self.secondary_tenants), True)
+            elif section == 'smb':
+                smb_apply(self.src, smb_actions(self.src, records, self.secondary_tenants), True)
+            else:
+                index = quota_index(self.src, secondary_objects.values())
+                quota_apply(self.src, quota_actions(self.src, lambda: records, self.workers, index), True, self.workers)
+        except Exception as excpt:
+            logging.error(f'{section}: setting the drifted objects failed: {excpt}')
+
+    def emit(self, section, events):
+        if events == []:
+            return
+        now = datetime.now(timezone.utc).isoformat()
+        events_file = open(self.events_file, 'a')
+        for event in events:
+            event = dict(time=now, section=section, **event)
+            events_file.write(json.dumps(event) + '\n')
+            if event['event'] == 'drifted':
+                logging.warning(f'{section}: {event["key"]} is {event["state"]} on the secondary')
+            else:
+                logging.info(f'{section}: {event["key"]} matches the primary again')
+        events_file.close()
+
+    def run(self, intervals):
+        '''Check every section on its own interval until interrupted'''
+        due = {section: time.monotonic() for section in intervals}
+        try:
+            while True:
+                section = min(due, key=due.get)
+                wait = due[section] - time.monotonic()
+                if wait > 0:
+                    time.sleep(wait)
+                try:
+                    self.check(section)
+                except Exception as excpt:
+                    logging.error(f'{section}: the check failed: {excpt}')
+                due[section] = max(due[section] + intervals[section], time.monotonic())
+        except KeyboardInterrupt:
+            logging.info('Watching was stopped')
+
+if __name__ == '__main__':
+    main(sys.argv[1:])